@@ -8,6 +8,7 @@ from fastapi.middleware.cors import CORSMiddleware
 import backend.log as log
 import backend.migrations_runner as migrations_runner
 from backend import conf
+from backend.response import ModelJSONResponse
 from backend.state import app_state
 from backend.view.accounts.view import router as account_router
 from backend.view.admin.view import router as admin_router
@@ -18,7 +19,7 @@ log.setup_logging()
 logger = logging.getLogger(__name__)
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=ModelJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
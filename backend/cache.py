@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from pydantic import BaseModel
+
+from backend.repository.payment import NewPayment
+from backend.repository.users import User
+
+logger = logging.getLogger(__name__)
+
+
+class CacheStatus(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    hit_rate: float
+
+
+class TransactionFilter:
+    """
+    LRU недавно записанных в БД транзакций.
+    Повтор вебхука с теми же данными можно подтвердить без запроса к БД.
+    Хранятся только закоммиченные платежи, поэтому ложных срабатываний
+    нет - при промахе решение принимает БД.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[str, tuple[int, int, int]] = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def contains(self, payment: NewPayment) -> bool:
+        known = self._items.get(payment.transaction_id)
+        if known != (payment.user_id, payment.account_id, payment.amount):
+            self._misses += 1
+            return False
+        self._items.move_to_end(payment.transaction_id)
+        self._hits += 1
+        return True
+
+    def add(self, payment: NewPayment) -> None:
+        if self.max_size <= 0:
+            return
+        self._items[payment.transaction_id] = (
+            payment.user_id,
+            payment.account_id,
+            payment.amount,
+        )
+        self._items.move_to_end(payment.transaction_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def status(self) -> CacheStatus:
+        total = self._hits + self._misses
+        return CacheStatus(
+            size=len(self._items),
+            max_size=self.max_size,
+            hits=self._hits,
+            misses=self._misses,
+            hit_rate=self._hits / total if total else 0.0,
+        )
+
+
+class SessionCache:
+    """
+    TTL + LRU кеш проверенных сессий: токен cookie -> пользователь.
+    Записи пользователя сбрасываются при смене токена, изменении
+    и удалении пользователя.
+    Сброс, пришедший во время запроса в БД, не должен потеряться:
+    перед запросом берётся generation(), и set не сохраняет
+    пользователя, сброшенного после этого снимка.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[str, tuple[User, float]] = OrderedDict()
+        self._tokens: dict[int, set[str]] = {}
+        self._hits = 0
+        self._misses = 0
+        # поколение последнего сброса по пользователям; забытые старые
+        # сбросы учитываются через _floor
+        self._generation = 0
+        self._invalidated: OrderedDict[int, int] = OrderedDict()
+        self._floor = 0
+
+    def get(self, token: str) -> User | None:
+        item = self._items.get(token)
+        if item is None or item[1] < time.monotonic():
+            if item is not None:
+                self._pop(token)
+            self._misses += 1
+            return None
+        self._items.move_to_end(token)
+        self._hits += 1
+        return item[0]
+
+    def generation(self) -> int:
+        return self._generation
+
+    def set(self, token: str, user: User, generation: int) -> None:
+        if self.max_size <= 0:
+            return
+        invalidated = max(self._floor, self._invalidated.get(user.id, 0))
+        if invalidated > generation:
+            # пользователя сбросили, пока его читали из БД
+            return
+        self._pop(token)
+        self._items[token] = (user, time.monotonic() + self.ttl)
+        self._tokens.setdefault(user.id, set()).add(token)
+        while len(self._items) > self.max_size:
+            self._pop(next(iter(self._items)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        for token in self._tokens.pop(user_id, set()):
+            self._items.pop(token, None)
+        self._generation += 1
+        self._invalidated.pop(user_id, None)
+        self._invalidated[user_id] = self._generation
+        while len(self._invalidated) > self.max_size:
+            _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._tokens.clear()
+        self._generation += 1
+        self._invalidated.clear()
+        self._floor = self._generation
+
+    def status(self) -> CacheStatus:
+        total = self._hits + self._misses
+        return CacheStatus(
+            size=len(self._items),
+            max_size=self.max_size,
+            hits=self._hits,
+            misses=self._misses,
+            hit_rate=self._hits / total if total else 0.0,
+        )
+
+    def _pop(self, token: str) -> None:
+        item = self._items.pop(token, None)
+        if item is None:
+            return
+        tokens = self._tokens.get(item[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[item[0].id]
+
+
+class RevocationList:
+    """
+    Отозванные версии stateless токенов (user_id -> максимальная
+    отозванная версия). Периодически перечитывается из БД, по событиям
+    шины инвалидации - сразу.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], Awaitable[dict[int, int]]],
+        refresh_interval: float,
+    ):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self._revoked: dict[int, int] = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def is_revoked(self, user_id: int, token_version: int) -> bool:
+        return token_version <= self._revoked.get(user_id, -1)
+
+    def refresh_soon(self, *args) -> None:
+        self._wake.set()
+
+    async def refresh(self) -> None:
+        self._revoked = await self.loader()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wake.wait(), self.refresh_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Revocation list refresh failed")
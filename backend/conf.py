@@ -5,3 +5,100 @@ AUTO_RELOAD = os.environ["AUTO_RELOAD"]
 PASSWORD_SALT = os.environ["PASSWORD_SALT"]
 COOKIE_SECRET_KEY = os.environ["COOKIE_SECRET_KEY"]
 WEBHOOK_SECRET_KEY = os.environ["WEBHOOK_SECRET_KEY"]
+
+# Пул соединений с БД (на один воркер uvicorn)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "True") == "True"
+
+# Максимальный размер пачки в /webhook/payment/batch
+PAYMENT_BATCH_MAX_SIZE = int(os.environ.get("PAYMENT_BATCH_MAX_SIZE", "5000"))
+
+# Режим приёма вебхуков: sync - сразу в БД, spool - через очередь на диске
+WEBHOOK_INGEST_MODE = os.environ.get("WEBHOOK_INGEST_MODE", "sync")
+INGEST_SPOOL_DIR = os.environ.get("INGEST_SPOOL_DIR", "./spool")
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "1000"))
+INGEST_FSYNC_INTERVAL = float(os.environ.get("INGEST_FSYNC_INTERVAL", "0.005"))
+# сколько раз повторять пачку, которую отвергает БД, до переноса в .dead
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", "5"))
+
+# Размер фильтра повторных transaction_id (0 - выключен)
+DEDUP_FILTER_SIZE = int(os.environ.get("DEDUP_FILTER_SIZE", "100000"))
+
+# Кеш проверенных сессий
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", "60"))
+
+# Режим сессий: db - токен в user_sessions,
+# stateless - подписанный токен с версией и сроком действия
+SESSION_MODE = os.environ.get("SESSION_MODE", "db")
+SESSION_TOKEN_TTL = int(os.environ.get("SESSION_TOKEN_TTL", "86400"))
+REVOCATION_REFRESH_INTERVAL = float(
+    os.environ.get("REVOCATION_REFRESH_INTERVAL", "10")
+)
+
+# Максимальный размер страницы списков
+PAGE_MAX_LIMIT = int(os.environ.get("PAGE_MAX_LIMIT", "1000"))
+
+# Максимальное количество строк в /users/import
+USER_IMPORT_MAX_ROWS = int(os.environ.get("USER_IMPORT_MAX_ROWS", "100000"))
+# и максимальный размер файла в байтах (50 MiB)
+USER_IMPORT_MAX_BYTES = int(
+    os.environ.get("USER_IMPORT_MAX_BYTES", "52428800")
+)
+
+# Хеширование паролей: pbkdf2_sha256 или scrypt, выполняется в пуле потоков
+PASSWORD_HASH_ALGORITHM = os.environ.get(
+    "PASSWORD_HASH_ALGORITHM", "pbkdf2_sha256"
+)
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "4"))
+# пул для импорта пользователей, отдельно от входа; KDF отпускает GIL,
+# по умолчанию поток на ядро
+PASSWORD_BULK_HASH_WORKERS = int(
+    os.environ.get("PASSWORD_BULK_HASH_WORKERS") or os.cpu_count() or 1
+)
+PBKDF2_ITERATIONS = int(os.environ.get("PBKDF2_ITERATIONS", "600000"))
+SCRYPT_N = int(os.environ.get("SCRYPT_N", "16384"))
+SCRYPT_R = int(os.environ.get("SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("SCRYPT_P", "1"))
+
+# Секции payment: сколько месяцев создавать заранее, сколько хранить
+# (0 - не отсоединять старые), период проверки в секундах
+PAYMENT_PARTITION_MONTHS_AHEAD = int(
+    os.environ.get("PAYMENT_PARTITION_MONTHS_AHEAD", "3")
+)
+PAYMENT_PARTITION_RETENTION_MONTHS = int(
+    os.environ.get("PAYMENT_PARTITION_RETENTION_MONTHS", "0")
+)
+PAYMENT_PARTITION_INTERVAL = float(
+    os.environ.get("PAYMENT_PARTITION_INTERVAL", "3600")
+)
+
+# Пополнение баланса: direct - UPDATE строки счёта,
+# ledger - запись в account_deltas и фоновое сворачивание в баланс
+BALANCE_MODE = os.environ.get("BALANCE_MODE", "direct")
+BALANCE_COMPACT_INTERVAL = float(
+    os.environ.get("BALANCE_COMPACT_INTERVAL", "1")
+)
+BALANCE_COMPACT_BATCH_SIZE = int(
+    os.environ.get("BALANCE_COMPACT_BATCH_SIZE", "10000")
+)
+
+# Склейка одновременных get_id пользователей (проверка stateless
+# токенов) в один запрос: максимум id в запросе (0 - выключено)
+# и окно ожидания в секундах (0 - один проход event loop)
+LOADER_MAX_BATCH_SIZE = int(os.environ.get("LOADER_MAX_BATCH_SIZE", "100"))
+LOADER_WAIT = float(os.environ.get("LOADER_WAIT", "0"))
+
+# Одинаковые одновременные чтения счетов и платежей - одним запросом
+READ_COALESCING = os.environ.get("READ_COALESCING", "True") == "True"
+
+# Поток новых платежей (SSE /payment/feed) через NOTIFY: включён ли,
+# очередь на подписчика, период heartbeat в секундах. Выключен по
+# умолчанию: NOTIFY в транзакции платежа берёт общий для кластера
+# lock при коммите и выстраивает коммиты вебхуков в очередь
+PAYMENT_FEED = os.environ.get("PAYMENT_FEED", "False") == "True"
+PAYMENT_FEED_QUEUE_SIZE = int(os.environ.get("PAYMENT_FEED_QUEUE_SIZE", "100"))
+PAYMENT_FEED_HEARTBEAT = float(os.environ.get("PAYMENT_FEED_HEARTBEAT", "15"))
@@ -0,0 +1,123 @@
+"""
+Скорость сборки моделей из строк БД: с валидацией (Model(**row) по
+mappings()) и доверенным путём (row_decoder). Строки генерируются
+запросом с теми же типами колонок, что и в таблицах, замеряется только
+сборка моделей.
+
+Запуск: python -m backend.decode_bench [строк]
+"""
+
+import asyncio
+import sys
+import time
+
+from sqlalchemy import text
+
+from backend.repository.account import Account
+from backend.repository.base import row_decoder
+from backend.repository.payment import Payment
+from backend.repository.sessions import Session
+from backend.repository.users import User
+from backend.state import app_state
+
+ROWS = 100_000
+REPEAT = 5
+
+QUERIES = [
+    (
+        User,
+        """
+        SELECT
+            g AS id,
+            ('user' || g)::varchar AS username,
+            ('user' || g || '@example.com')::varchar AS email,
+            false AS is_admin,
+            md5(g::text)::varchar AS password,
+            0 AS token_version,
+            (now() at time zone 'utc') AS created_timestamp
+        FROM generate_series(1, :rows) AS g
+        """,
+    ),
+    (
+        Account,
+        """
+        SELECT
+            g AS id,
+            g % 1000 AS user_id,
+            g * 10 AS balance,
+            (now() at time zone 'utc') AS created_timestamp
+        FROM generate_series(1, :rows) AS g
+        """,
+    ),
+    (
+        Payment,
+        """
+        SELECT
+            g AS id,
+            g % 1000 AS user_id,
+            g % 5000 AS account_id,
+            g % 100 AS amount,
+            md5(g::text)::varchar AS transaction_id,
+            (now() at time zone 'utc') AS created_timestamp
+        FROM generate_series(1, :rows) AS g
+        """,
+    ),
+    (
+        Session,
+        """
+        SELECT
+            g AS id,
+            g AS user_id,
+            (md5(g::text) || md5(g::text))::varchar AS token,
+            (now() at time zone 'utc') AS created_timestamp
+        FROM generate_series(1, :rows) AS g
+        """,
+    ),
+]
+
+
+def best(call) -> float:
+    # Лучшее время из REPEAT запусков
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+async def run(rows: int) -> None:
+    print(f"{'model':<10}{'validated':>14}{'trusted':>14}{'speedup':>10}")
+    for model, sql in QUERIES:
+        async with app_state.db() as session:
+            result = await session.execute(text(sql), {"rows": rows})
+            keys = list(result.keys())
+            data = result.all()
+
+        def validated():
+            return [model(**row._mapping) for row in data]
+
+        def trusted():
+            decode = row_decoder(model, keys)
+            return [decode(row) for row in data]
+
+        assert validated() == trusted()
+        slow = rows / best(validated)
+        fast = rows / best(trusted)
+        print(
+            f"{model.__name__:<10}{slow:>10.0f} r/s{fast:>10.0f} r/s"
+            f"{fast / slow:>9.1f}x"
+        )
+
+
+async def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    await app_state.startup()
+    try:
+        await run(rows)
+    finally:
+        await app_state.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
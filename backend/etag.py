@@ -0,0 +1,25 @@
+import hashlib
+
+from fastapi import Request, Response, status
+
+
+def make_etag(*parts) -> str:
+    # ETag из версии данных и параметров запроса
+    data = "|".join(str(part) for part in parts)
+    return '"' + hashlib.sha1(data.encode()).hexdigest() + '"'
+
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """
+    Ответ 304, если клиент прислал ETag актуальной версии в
+    If-None-Match, иначе None.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    if etag not in tags and "*" not in tags:
+        return None
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+    )
@@ -0,0 +1,244 @@
+"""
+Проверка, что запросы репозиториев идут по индексам.
+
+Методы репозиториев вызываются на текущей БД, их SQL перехватывается
+и прогоняется через EXPLAIN с enable_seqscan = off и enable_sort = off:
+на маленькой таблице планировщик и так выберет seq scan и сортировку,
+а проверить нужно, что подходящий индекс есть и отдаёт строки
+в нужном порядке. Для запросов к payment с интервалом дат проверяется
+и отсечение секций.
+
+Запуск: python -m backend.explain_check
+"""
+
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from backend.pagination import Page
+from backend.state import app_state
+
+MONTH_START = datetime.utcnow().replace(
+    day=1, hour=0, minute=0, second=0, microsecond=0
+)
+TRANSACTION = ("BEGIN", "COMMIT", "ROLLBACK")
+PAGE = Page(limit=100)
+PAGE_AFTER = Page(limit=100, after=(datetime(2000, 1, 1), 1))
+PAGE_DATES = Page(
+    limit=100, date_from=datetime(2000, 1, 1), date_to=datetime(2100, 1, 1)
+)
+PAGE_DAY = Page(
+    limit=100, date_from=MONTH_START, date_to=MONTH_START + timedelta(days=1)
+)
+
+
+def checks() -> list:
+    # (название, вызов репозитория, ожидаемый индекс (None - любой),
+    #  максимум просканированных секций)
+    return [
+        (
+            "accounts.get_by_user_id",
+            lambda: app_state.account_repo.get_by_user_id(
+                user_id=1, page=PAGE
+            ),
+            "accounts_user_id_created_timestamp_idx",
+            None,
+        ),
+        (
+            "accounts.get_by_user_id cursor",
+            lambda: app_state.account_repo.get_by_user_id(
+                user_id=1, page=PAGE_AFTER
+            ),
+            "accounts_user_id_created_timestamp_idx",
+            None,
+        ),
+        (
+            "accounts.get_version",
+            lambda: app_state.account_repo.get_version(user_id=1),
+            "accounts_user_id_created_timestamp_idx",
+            None,
+        ),
+        (
+            "payment.get_version",
+            lambda: app_state.payment_repo.get_version(user_id=1),
+            "payment_user_id_created_timestamp_idx",
+            None,
+        ),
+        (
+            "payment.get_by_user_id",
+            lambda: app_state.payment_repo.get_by_user_id(
+                user_id=1, page=PAGE
+            ),
+            "payment_user_id_created_timestamp_idx",
+            None,
+        ),
+        (
+            "payment.get_by_user_id cursor",
+            lambda: app_state.payment_repo.get_by_user_id(
+                user_id=1, page=PAGE_AFTER
+            ),
+            "payment_user_id_created_timestamp_idx",
+            None,
+        ),
+        (
+            "payment.get_by_user_id dates",
+            lambda: app_state.payment_repo.get_by_user_id(
+                user_id=1, page=PAGE_DATES
+            ),
+            "payment_user_id_created_timestamp_idx",
+            None,
+        ),
+        (
+            "payment.get_by_user_id one day",
+            lambda: app_state.payment_repo.get_by_user_id(
+                user_id=1, page=PAGE_DAY
+            ),
+            None,
+            1,
+        ),
+        (
+            "payment.get_recent",
+            lambda: app_state.payment_repo.get_recent(limit=100),
+            "payment_created_timestamp_idx",
+            None,
+        ),
+        (
+            "payment.get_daily_totals",
+            lambda: app_state.payment_repo.get_daily_totals(
+                user_id=1, date_from=MONTH_START.date()
+            ),
+            None,
+            None,
+        ),
+        (
+            "payment.get_account_totals",
+            lambda: app_state.payment_repo.get_account_totals(account_id=1),
+            "payment_daily_pkey",
+            None,
+        ),
+        (
+            "users.get_all",
+            lambda: app_state.user_repo.get_all(page=PAGE),
+            "users_created_timestamp_idx",
+            None,
+        ),
+        (
+            "users.get_all cursor",
+            lambda: app_state.user_repo.get_all(page=PAGE_AFTER),
+            "users_created_timestamp_idx",
+            None,
+        ),
+    ]
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+async def capture(call) -> list[tuple[str, tuple]]:
+    # SQL, который метод репозитория отправляет в БД: первый запрос
+    # транзакции идёт через SQLAlchemy, остальные - через соединение
+    # asyncpg напрямую, логгер запросов вешается на каждое взятое из
+    # пула соединение
+    statements = []
+    connections = []
+
+    def logger(record):
+        if not record.query.lstrip().upper().startswith(TRANSACTION):
+            statements.append((record.query, tuple(record.args or ())))
+
+    def cursor_execute(conn, cursor, statement, parameters, context, many):
+        statements.append((statement, tuple(parameters or ())))
+
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        connection = dbapi_connection.driver_connection
+        connection.add_query_logger(logger)
+        connections.append(connection)
+
+    event.listen(Pool, "checkout", checkout)
+    event.listen(Engine, "before_cursor_execute", cursor_execute)
+    try:
+        await call()
+    finally:
+        event.remove(Pool, "checkout", checkout)
+        event.remove(Engine, "before_cursor_execute", cursor_execute)
+        for connection in connections:
+            connection.remove_query_logger(logger)
+    return statements
+
+
+async def explain(statement: str, parameters: tuple) -> tuple[list, set]:
+    # Узлы плана и индексы (для секций - индекс родительской таблицы)
+    async with app_state.db() as session:
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        async with driver_connection.transaction():
+            await driver_connection.execute(
+                "SET LOCAL enable_seqscan = off; SET LOCAL enable_sort = off"
+            )
+            result = await driver_connection.fetchval(
+                "EXPLAIN (FORMAT JSON) " + statement, *parameters
+            )
+            # engine регистрирует json кодек на соединении
+            if isinstance(result, str):
+                result = json.loads(result)
+            nodes = list(plan_nodes(result[0]["Plan"]))
+            indexes = await driver_connection.fetchval(
+                """
+                SELECT array_agg(
+                    coalesce(pg_partition_root(to_regclass(name))::text, name)
+                )
+                FROM unnest($1::text[]) AS name
+                """,
+                [node["Index Name"] for node in nodes if "Index Name" in node],
+            )
+    return nodes, set(indexes or [])
+
+
+async def run() -> bool:
+    ok = True
+    for name, call, index, max_partitions in checks():
+        statements = await capture(call)
+        if not statements:
+            print(f"FAIL {name}: no queries captured")
+            ok = False
+            continue
+        nodes, indexes = await explain(*statements[-1])
+        sorts = [node for node in nodes if node["Node Type"] == "Sort"]
+        relations = {
+            node["Relation Name"] for node in nodes if "Relation Name" in node
+        }
+        used = indexes if index is None else indexes & {index}
+        if not used:
+            print(f"FAIL {name}: {index or 'index'} not used, plan {indexes}")
+            ok = False
+        elif sorts:
+            print(f"FAIL {name}: index used, but rows are sorted")
+            ok = False
+        elif max_partitions is not None and len(relations) > max_partitions:
+            print(f"FAIL {name}: partitions not pruned, scans {relations}")
+            ok = False
+        else:
+            print(f"OK   {name}: {', '.join(sorted(used))}")
+    return ok
+
+
+async def main() -> int:
+    await app_state.startup()
+    try:
+        ok = await run()
+    finally:
+        await app_state.shutdown()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
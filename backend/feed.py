@@ -0,0 +1,87 @@
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+from typing import Iterator
+
+from pydantic import BaseModel
+
+from backend.notify import NotifyListener
+
+logger = logging.getLogger(__name__)
+
+
+class FeedStatus(BaseModel):
+    users: int
+    subscribers: int
+    delivered: int
+    dropped: int
+
+
+class PaymentFeed:
+    """
+    Рассылка новых платежей подписчикам воркера.
+    Платежи приходят через NOTIFY после коммита по общему соединению
+    LISTEN. Подписчик, который не успевает читать, отключается, после
+    переподключения LISTEN подписчикам уходит reset - события могли
+    быть потеряны.
+    """
+
+    CHANNEL = "payment_feed"
+    RESET = "reset"
+
+    def __init__(self, listener: NotifyListener, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[asyncio.Queue]] = {}
+        self._delivered = 0
+        self._dropped = 0
+        listener.subscribe(self.CHANNEL, self._on_message)
+        listener.on_reconnect(self._on_reconnect)
+
+    @contextmanager
+    def subscribe(self, user_id: int) -> Iterator[asyncio.Queue]:
+        # Очередь событий пользователя; None - подписка закрыта
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            self._unsubscribe(user_id, queue)
+
+    def _unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def _send(
+        self, user_id: int, queue: asyncio.Queue, event: str, data: str
+    ) -> None:
+        try:
+            queue.put_nowait((event, data))
+            self._delivered += 1
+        except asyncio.QueueFull:
+            # медленный клиент: закрываем поток, клиент переподключится
+            self._dropped += 1
+            self._unsubscribe(user_id, queue)
+            queue.get_nowait()
+            queue.put_nowait(None)
+
+    def _on_message(self, payload: str) -> None:
+        user_id = json.loads(payload)["user_id"]
+        for queue in list(self._subscribers.get(user_id, ())):
+            self._send(user_id, queue, "payment", payload)
+
+    def _on_reconnect(self) -> None:
+        for user_id, queues in list(self._subscribers.items()):
+            for queue in list(queues):
+                self._send(user_id, queue, self.RESET, "{}")
+
+    def status(self) -> FeedStatus:
+        return FeedStatus(
+            users=len(self._subscribers),
+            subscribers=sum(len(q) for q in self._subscribers.values()),
+            delivered=self._delivered,
+            dropped=self._dropped,
+        )
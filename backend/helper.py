@@ -2,14 +2,30 @@ import base64
 import hashlib
 import hmac
 import logging
+import time
+from typing import AsyncIterator
 
 from fastapi import Cookie, HTTPException, status
-
-from backend.conf import COOKIE_SECRET_KEY, PASSWORD_SALT, WEBHOOK_SECRET_KEY
+from pydantic import BaseModel, ValidationError
+
+from backend.conf import (
+    COOKIE_SECRET_KEY,
+    SESSION_TOKEN_TTL,
+    WEBHOOK_SECRET_KEY,
+)
+from backend.repository.base import UnitOfWork, unit_of_work_contextvar
 from backend.repository.users import User
 from backend.state import app_state
 
 logger = logging.getLogger(__name__)
+TOKEN_PREFIX = "v2."
+
+
+class SessionToken(BaseModel):
+    uid: int
+    ver: int
+    iat: int
+    exp: int
 
 
 def _sign_data(data: str) -> str:
@@ -42,11 +58,50 @@ def cookie_decode(username_signed: str) -> str | None:
             return None
 
 
-def hash_password(password: str) -> str:
-    # Хеширование пароля
-    return (
-        hashlib.sha256((password + PASSWORD_SALT).encode()).hexdigest().lower()
+def token_create(user_id: int, token_version: int) -> str:
+    # Stateless токен: id пользователя, версия и срок действия
+    now = int(time.time())
+    payload = SessionToken(
+        uid=user_id, ver=token_version, iat=now, exp=now + SESSION_TOKEN_TTL
+    )
+    data = (
+        TOKEN_PREFIX
+        + base64.urlsafe_b64encode(payload.model_dump_json().encode()).decode()
     )
+    return data + "." + _sign_data(data)
+
+
+def token_decode(token: str) -> SessionToken | None:
+    # Проверка подписи и срока действия stateless токена
+    data, _, sign = token.rpartition(".")
+    if not data.startswith(TOKEN_PREFIX):
+        return None
+    if not hmac.compare_digest(_sign_data(data), sign):
+        return None
+    try:
+        payload = SessionToken.model_validate_json(
+            base64.urlsafe_b64decode(data.removeprefix(TOKEN_PREFIX))
+        )
+    except (ValueError, ValidationError):
+        return None
+    if payload.exp < time.time():
+        return None
+    return payload
+
+
+async def unit_of_work() -> AsyncIterator[UnitOfWork]:
+    # Зависимость: общая транзакция для всех репозиториев в запросе
+    uow = UnitOfWork(db=app_state.db)
+    token = unit_of_work_contextvar.set(uow)
+    try:
+        yield uow
+        await uow.commit()
+    except Exception:
+        await uow.rollback()
+        raise
+    finally:
+        await uow.close()
+        unit_of_work_contextvar.reset(token)
 
 
 async def check_session(cookie: str | None = Cookie(default=None)) -> User:
@@ -56,27 +111,57 @@ async def check_session(cookie: str | None = Cookie(default=None)) -> User:
         logger.info("No session cookie.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
+    if cookie.startswith(TOKEN_PREFIX):
+        return await _check_stateless_session(cookie)
+
+    user = app_state.session_cache.get(cookie)
+    if user:
+        return user
+
     user_mail = cookie_decode(cookie)
     if not user_mail:
         logger.info("Wrong session cookie.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    user = await app_state.user_repo.get_email(email=user_mail)
+    generation = app_state.session_cache.generation()
+    user = await app_state.user_repo.get_by_session(
+        token=cookie, email=user_mail
+    )
     if not user:
-        logger.info("User not found.")
+        logger.info("Session not found.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    session = await app_state.session_repo.get_by_token(token=cookie)
-    if not session:
-        logger.info("Session not found.")
+    app_state.session_cache.set(cookie, user, generation)
+    return user
+
+
+async def _check_stateless_session(cookie: str) -> User:
+    # Проверка без обращения к user_sessions: подпись, срок, отзыв
+    token = token_decode(cookie)
+    if not token:
+        logger.info("Wrong session cookie.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
-    if session.user_id == user.id:
+    revocation_list = app_state.revocation_list
+    if not revocation_list or revocation_list.is_revoked(
+        user_id=token.uid, token_version=token.ver
+    ):
+        logger.info("Session revoked.")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+    user = app_state.session_cache.get(cookie)
+    if user:
         return user
-    else:
-        logger.info("Invalid user")
+
+    generation = app_state.session_cache.generation()
+    user = await app_state.user_repo.get_id(id=token.uid)
+    if not user or user.token_version != token.ver:
+        logger.info("Session revoked.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
 
+    app_state.session_cache.set(cookie, user, generation)
+    return user
+
 
 def signature_payment_check(
     user_id: int,
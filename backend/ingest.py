@@ -0,0 +1,357 @@
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+import asyncpg
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import exc
+
+from backend.repository.payment import (
+    ConcurrentAccountCreation,
+    NewPayment,
+    PaymentStatus,
+)
+
+logger = logging.getLogger(__name__)
+
+SPOOL_FILE_PREFIX = "payments"
+RETRY_DELAY = 1
+# Ошибки, в которых платёж не виноват: их повторяем, пока БД не ответит
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.TransactionRollbackError,
+    exc.OperationalError,
+    exc.InterfaceError,
+    exc.TimeoutError,
+    ConcurrentAccountCreation,
+)
+
+
+class SpooledPayment(BaseModel):
+    payment: NewPayment
+    accepted_timestamp: float
+
+
+class IngestStatus(BaseModel):
+    spool_file: str
+    depth: int
+    lag_seconds: float
+    accepted: int
+    processed: int
+    failed_batches: int
+    dead_lettered: int
+
+
+class PaymentSpool:
+    """
+    Очередь вебхуков на диске.
+
+    Вебхук подтверждается после записи в файл и fsync (fsync общий на
+    все записи, пришедшие за fsync_interval). Фоновый воркер пачками
+    переносит записи в БД и сохраняет смещение обработанной части файла,
+    поэтому после падения необработанные записи читаются заново.
+    Повторная обработка безопасна - платежи идемпотентны
+    по transaction_id.
+
+    Пачка, которую БД не принимает max_attempts раз подряд, проводится
+    по одному платежу; платёж, который так и не прошёл, и нечитаемая
+    запись переносятся в файл .dead рядом с очередью и не держат её.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        handler: Callable[[list[NewPayment]], Awaitable[list[PaymentStatus]]],
+        batch_size: int,
+        fsync_interval: float,
+        max_attempts: int,
+    ):
+        self.directory = directory
+        self.handler = handler
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.max_attempts = max_attempts
+
+        self._path = ""
+        self._lock_file = None
+        self._file = None
+        self._offset = 0
+        self._durable_size = 0
+        self._waiters: list[asyncio.Future] = []
+        self._pending: deque[float] = deque()
+        self._flush_event = asyncio.Event()
+        self._data_event = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._accepted = 0
+        self._processed = 0
+        self._failed_batches = 0
+        self._dead_lettered = 0
+
+    @property
+    def _offset_path(self) -> str:
+        return self._path + ".offset"
+
+    @property
+    def _dead_path(self) -> str:
+        return self._path + ".dead"
+
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._claim_file()
+        self._recover()
+        self._file = open(self._path, "ab")
+        self._tasks = [
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._drain_loop()),
+        ]
+        if self._pending:
+            logger.info(
+                "Replaying %s payments from %s", len(self._pending), self._path
+            )
+            self._data_event.set()
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def append(self, payment: NewPayment) -> None:
+        # Возвращается, когда запись гарантированно на диске
+        record = SpooledPayment(
+            payment=payment, accepted_timestamp=time.time()
+        )
+        self._file.write(record.model_dump_json().encode() + b"\n")
+        self._pending.append(record.accepted_timestamp)
+        self._accepted += 1
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._flush_event.set()
+        await waiter
+
+    def status(self) -> IngestStatus:
+        lag = time.time() - self._pending[0] if self._pending else 0.0
+        return IngestStatus(
+            spool_file=self._path,
+            depth=len(self._pending),
+            lag_seconds=lag,
+            accepted=self._accepted,
+            processed=self._processed,
+            failed_batches=self._failed_batches,
+            dead_lettered=self._dead_lettered,
+        )
+
+    def _claim_file(self) -> None:
+        # Каждый воркер uvicorn забирает себе свободный файл очереди,
+        # файл упавшего воркера подхватит следующий запущенный
+        number = 0
+        while True:
+            path = os.path.join(
+                self.directory, f"{SPOOL_FILE_PREFIX}-{number}.ndjson"
+            )
+            lock_file = open(path + ".lock", "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                number += 1
+                continue
+            self._path = path
+            self._lock_file = lock_file
+            return
+
+    def _recover(self) -> None:
+        if not os.path.exists(self._path):
+            open(self._path, "wb").close()
+        with open(self._path, "rb+") as f:
+            data = f.read()
+            # недописанная строка не была подтверждена - отбрасываем
+            complete = data.rfind(b"\n") + 1
+            if complete != len(data):
+                f.truncate(complete)
+                os.fsync(f.fileno())
+
+        self._offset = min(self._read_offset(), complete)
+        self._durable_size = complete
+        pending = data[self._offset : complete]  # noqa: E203
+        for line in pending.splitlines():
+            try:
+                record = SpooledPayment.model_validate_json(line)
+                self._pending.append(record.accepted_timestamp)
+            except ValidationError:
+                # в .dead её перенесёт воркер
+                self._pending.append(time.time())
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self._offset_path) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, offset: int) -> None:
+        tmp_path = self._offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._offset_path)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._flush_event.wait()
+            await asyncio.sleep(self.fsync_interval)
+            self._flush_event.clear()
+
+            waiters, self._waiters = self._waiters, []
+            self._file.flush()
+            size = self._file.tell()
+            try:
+                await asyncio.to_thread(os.fsync, self._file.fileno())
+            except Exception as e:
+                logger.exception("Spool fsync failed")
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+
+            self._durable_size = size
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self._data_event.set()
+
+    async def _drain_loop(self) -> None:
+        while True:
+            await self._data_event.wait()
+            self._data_event.clear()
+            while self._offset < self._durable_size:
+                lines, end = await asyncio.to_thread(self._read_batch)
+                records = []
+                for line in lines:
+                    try:
+                        records.append(
+                            SpooledPayment.model_validate_json(line)
+                        )
+                    except ValidationError:
+                        logger.error("Malformed spool record: %r", line)
+                        await self._dead_letter([line])
+                statuses = await self._process(records)
+
+                for record, payment_status in zip(records, statuses):
+                    if payment_status in (
+                        PaymentStatus.USER_NOT_FOUND,
+                        PaymentStatus.WRONG_ACCOUNT,
+                    ):
+                        logger.info(
+                            "Spooled payment %s rejected: %s",
+                            record.payment.transaction_id,
+                            payment_status.value,
+                        )
+                await self._commit(end, len(lines))
+
+    async def _process(
+        self, records: list[SpooledPayment]
+    ) -> list[PaymentStatus | None]:
+        # None - платёж перенесён в .dead
+        if not records:
+            return []
+        payments = [record.payment for record in records]
+        attempts = 0
+        while attempts < self.max_attempts:
+            try:
+                return await self.handler(payments)
+            except TRANSIENT_ERRORS:
+                # БД недоступна - ждём, попытка не считается
+                logger.exception("Spool batch failed, retrying")
+            except Exception:
+                attempts += 1
+                logger.exception("Spool batch failed (attempt %s)", attempts)
+            self._failed_batches += 1
+            if attempts < self.max_attempts:
+                await asyncio.sleep(RETRY_DELAY)
+
+        if len(records) == 1:
+            logger.error(
+                "Spooled payment %s failed %s times, moving to %s",
+                records[0].payment.transaction_id,
+                attempts,
+                self._dead_path,
+            )
+            await self._dead_letter([records[0].model_dump_json().encode()])
+            return [None]
+        logger.error(
+            "Spool batch failed %s times, processing payments one by one",
+            attempts,
+        )
+        statuses = []
+        for record in records:
+            statuses.extend(await self._process([record]))
+        return statuses
+
+    async def _dead_letter(self, lines: list[bytes]) -> None:
+        self._dead_lettered += len(lines)
+        await asyncio.to_thread(self._write_dead, lines)
+
+    def _write_dead(self, lines: list[bytes]) -> None:
+        with open(self._dead_path, "ab") as f:
+            for line in lines:
+                f.write(line.rstrip(b"\n") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_batch(self) -> tuple[list[bytes], int]:
+        with open(self._path, "rb") as f:
+            f.seek(self._offset)
+            lines = []
+            end = self._offset
+            while len(lines) < self.batch_size and end < self._durable_size:
+                line = f.readline()
+                lines.append(line)
+                end += len(line)
+        return lines, end
+
+    async def _commit(self, offset: int, count: int) -> None:
+        self._processed += count
+        for _ in range(count):
+            self._pending.popleft()
+        self._offset = offset
+
+        if self._drained(offset):
+            # всё обработано - сжимаем файл. Смещение 0 сохраняется
+            # до усечения: после падения между ними записи будут
+            # обработаны повторно, но не потеряны
+            await asyncio.to_thread(self._write_offset, 0)
+            # без await между проверкой и усечением, чтобы не потерять
+            # новые записи
+            if self._drained(offset):
+                self._file.truncate(0)
+                self._file.seek(0)
+                self._offset = 0
+                self._durable_size = 0
+                await asyncio.to_thread(os.fsync, self._file.fileno())
+                return
+        await asyncio.to_thread(self._write_offset, offset)
+
+    def _drained(self, offset: int) -> bool:
+        if self._pending or self._waiters:
+            return False
+        self._file.flush()
+        return self._file.tell() == offset
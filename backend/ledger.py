@@ -0,0 +1,45 @@
+import asyncio
+import logging
+
+from backend.repository.account import AccountRepository
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceCompactor:
+    """
+    Фоновое сворачивание account_deltas в accounts.balance.
+    Пока изменений больше пачки - сворачивает без паузы.
+    """
+
+    def __init__(
+        self,
+        account_repo: AccountRepository,
+        interval: float,
+        batch_size: int,
+    ):
+        self.account_repo = account_repo
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                moved = await self.account_repo.compact_deltas(
+                    limit=self.batch_size
+                )
+            except Exception:
+                logger.exception("Balance compaction failed")
+                moved = 0
+            if moved < self.batch_size:
+                await asyncio.sleep(self.interval)
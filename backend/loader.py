@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from functools import partial
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BatchLoader(Generic[T]):
+    """
+    Склейка одновременных точечных запросов по id: ключи, запрошенные
+    за один проход event loop (или за окно wait), уходят в БД одним
+    запросом load_many, результаты раздаются вызывающим.
+    """
+
+    def __init__(
+        self,
+        load_many: Callable[[list[int]], Awaitable[dict[int, T]]],
+        max_batch_size: int,
+        wait: float,
+    ):
+        self.load_many = load_many
+        self.max_batch_size = max_batch_size
+        self.wait = wait
+        self._pending: dict[int, list[asyncio.Future]] = {}
+        self._handle: asyncio.Handle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load(self, id: int) -> T | None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(id, []).append(future)
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._handle is None:
+            if self.wait > 0:
+                self._handle = loop.call_later(self.wait, self._dispatch)
+            else:
+                self._handle = loop.call_soon(self._dispatch)
+        return await future
+
+    def _dispatch(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: dict[int, list[asyncio.Future]]) -> None:
+        try:
+            result = await self.load_many(list(batch))
+        except asyncio.CancelledError:
+            for futures in batch.values():
+                for future in futures:
+                    future.cancel()
+            raise
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for id, futures in batch.items():
+            for future in futures:
+                # вызывающий мог быть отменён
+                if not future.done():
+                    future.set_result(result.get(id))
+
+
+class FlightStatus(BaseModel):
+    calls: int
+    coalesced: int
+    in_flight: int
+
+
+class SingleFlight:
+    """
+    Одинаковые одновременные чтения выполняются одним запросом:
+    пока запрос по ключу в работе, остальные вызовы ждут его результат.
+    Результат не хранится - после завершения запроса следующий вызов
+    идёт в БД. После коммита записи (advance) к запросам, начатым до
+    него, новые вызовы не присоединяются - они могли не увидеть запись.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, tuple[int, asyncio.Task]] = {}
+        self._generation = 0
+        self._total = 0
+        self._coalesced = 0
+
+    def advance(self) -> None:
+        self._generation += 1
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        flight = self._calls.get(key)
+        if flight is None or flight[0] != self._generation:
+            self._total += 1
+            # запрос в отдельной задаче - отмена первого вызывающего
+            # не отменяет его для остальных
+            task = asyncio.ensure_future(call())
+            self._calls[key] = (self._generation, task)
+            task.add_done_callback(partial(self._done, key))
+        else:
+            task = flight[1]
+            self._coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task) -> None:
+        flight = self._calls.get(key)
+        if flight is not None and flight[1] is task:
+            del self._calls[key]
+        # ошибку могли не забрать, если все вызывающие отменены
+        if not task.cancelled():
+            task.exception()
+
+    def status(self) -> FlightStatus:
+        return FlightStatus(
+            calls=self._total + self._coalesced,
+            coalesced=self._coalesced,
+            in_flight=len(self._calls),
+        )
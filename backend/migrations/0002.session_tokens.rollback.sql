@@ -0,0 +1,3 @@
+drop table session_revocations;
+
+alter table users drop column "token_version";
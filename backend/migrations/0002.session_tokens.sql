@@ -0,0 +1,8 @@
+alter table users add column "token_version" int not null default 0;
+
+create table session_revocations(
+    "user_id" int not null,
+    "token_version" int not null,
+    "created_timestamp" timestamp not null default (now() at time zone 'utc'),
+    primary key ("user_id", "token_version")
+);
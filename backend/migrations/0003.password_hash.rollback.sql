@@ -0,0 +1 @@
+alter table users alter column "password" type varchar(64);
@@ -0,0 +1,5 @@
+-- transactional: false
+drop index concurrently if exists "users_created_timestamp_idx";
+drop index concurrently if exists "payment_account_id_idx";
+drop index concurrently if exists "payment_user_id_created_timestamp_idx";
+drop index concurrently if exists "accounts_user_id_created_timestamp_idx";
@@ -0,0 +1,9 @@
+-- transactional: false
+create index concurrently if not exists "accounts_user_id_created_timestamp_idx"
+    on accounts ("user_id", "created_timestamp", "id");
+create index concurrently if not exists "payment_user_id_created_timestamp_idx"
+    on payment ("user_id", "created_timestamp", "id");
+create index concurrently if not exists "payment_account_id_idx"
+    on payment ("account_id");
+create index concurrently if not exists "users_created_timestamp_idx"
+    on users ("created_timestamp", "id");
@@ -0,0 +1,25 @@
+create table payment_plain(
+    "id" int primary key default nextval('payment_id_seq'),
+    "transaction_id" varchar(64) not null unique,
+    "user_id" int not null references users(id),
+    "account_id" int references accounts(id),
+    "amount" int not null,
+    "created_timestamp" timestamp not null default (now() at time zone 'utc')
+);
+insert into payment_plain (id, transaction_id, user_id, account_id, amount, created_timestamp)
+    select id, transaction_id, user_id, account_id, amount, created_timestamp
+    from payment;
+
+alter sequence payment_id_seq owned by none;
+drop table payment;
+drop table payment_transactions;
+
+alter table payment_plain rename to payment;
+alter table payment rename constraint "payment_plain_pkey" to "payment_pkey";
+alter table payment rename constraint "payment_plain_transaction_id_key" to "payment_transaction_id_key";
+alter table payment rename constraint "payment_plain_user_id_fkey" to "payment_user_id_fkey";
+alter table payment rename constraint "payment_plain_account_id_fkey" to "payment_account_id_fkey";
+alter sequence payment_id_seq owned by payment.id;
+create index "payment_user_id_created_timestamp_idx"
+    on payment ("user_id", "created_timestamp", "id");
+create index "payment_account_id_idx" on payment ("account_id");
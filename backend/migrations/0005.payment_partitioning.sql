@@ -0,0 +1,61 @@
+-- transaction_id uniqueness across all payment partitions
+create table payment_transactions(
+    "transaction_id" varchar(64) primary key,
+    "payment_id" int not null,
+    "created_timestamp" timestamp not null default (now() at time zone 'utc')
+);
+insert into payment_transactions (transaction_id, payment_id, created_timestamp)
+    select transaction_id, id, created_timestamp from payment;
+
+alter table payment rename to payment_old;
+alter sequence payment_id_seq owned by none;
+
+create table payment(
+    "id" int not null default nextval('payment_id_seq'),
+    "transaction_id" varchar(64) not null,
+    "user_id" int not null
+        constraint "payment_user_id_fkey" references users(id),
+    "account_id" int
+        constraint "payment_account_id_fkey" references accounts(id),
+    "amount" int not null,
+    "created_timestamp" timestamp not null default (now() at time zone 'utc')
+) partition by range ("created_timestamp");
+
+create table payment_default partition of payment default;
+
+-- monthly partitions from the oldest payment to three months ahead,
+-- later ones are created by the app
+do $$
+declare
+    month date := date_trunc(
+        'month',
+        coalesce(
+            (select min(created_timestamp) from payment_old),
+            now() at time zone 'utc'
+        )
+    );
+begin
+    while month <= date_trunc('month', now() at time zone 'utc') + interval '3 months' loop
+        execute format(
+            'create table %I partition of payment for values from (%L) to (%L)',
+            'payment_' || to_char(month, '"y"YYYY"m"MM'),
+            month,
+            month + interval '1 month'
+        );
+        month := month + interval '1 month';
+    end loop;
+end
+$$;
+
+insert into payment (id, transaction_id, user_id, account_id, amount, created_timestamp)
+    select id, transaction_id, user_id, account_id, amount, created_timestamp
+    from payment_old;
+drop table payment_old;
+
+alter sequence payment_id_seq owned by payment.id;
+alter table payment add constraint "payment_pkey" primary key ("id", "created_timestamp");
+create index "payment_user_id_created_timestamp_idx"
+    on payment ("user_id", "created_timestamp", "id");
+create index "payment_account_id_idx" on payment ("account_id");
+create index "payment_created_timestamp_idx"
+    on payment ("created_timestamp", "id");
@@ -0,0 +1,9 @@
+update accounts
+    set balance = accounts.balance + pending.amount
+    from (
+        select account_id, sum(amount) as amount
+        from account_deltas
+        group by account_id
+    ) as pending
+    where accounts.id = pending.account_id;
+drop table account_deltas;
@@ -0,0 +1,8 @@
+-- pending balance changes, folded into accounts.balance by the app
+create table account_deltas(
+    "id" bigserial primary key,
+    "account_id" int not null references accounts(id),
+    "amount" int not null,
+    "created_timestamp" timestamp not null default (now() at time zone 'utc')
+);
+create index "account_deltas_account_id_idx" on account_deltas ("account_id");
@@ -0,0 +1 @@
+drop table payment_daily;
@@ -0,0 +1,24 @@
+-- per-account daily payment totals, several shard rows per day
+-- so that hot accounts do not contend on a single row
+create table payment_daily(
+    "account_id" int not null references accounts(id),
+    "day" date not null,
+    "shard" smallint not null default 0,
+    "user_id" int not null,
+    "amount" bigint not null default 0,
+    "count" int not null default 0,
+    primary key ("account_id", "day", "shard")
+);
+create index "payment_daily_day_idx" on payment_daily ("day");
+create index "payment_daily_user_id_day_idx" on payment_daily ("user_id", "day");
+
+insert into payment_daily (account_id, day, user_id, amount, count)
+    select
+        payment.account_id,
+        payment.created_timestamp::date,
+        accounts.user_id,
+        sum(payment.amount),
+        count(*)
+    from payment
+    join accounts on accounts.id = payment.account_id
+    group by payment.account_id, payment.created_timestamp::date, accounts.user_id;
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+from typing import Callable
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 1
+PING_INTERVAL = 30
+
+
+class NotifyListener:
+    """
+    Отдельное соединение воркера для LISTEN.
+    При обрыве переподключается и сообщает подписчикам on_reconnect -
+    события за время обрыва могли быть потеряны.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._channels: dict[str, list[Callable[[str], None]]] = {}
+        self._reconnect_handlers: list[Callable[[], None]] = []
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]):
+        self._channels.setdefault(channel, []).append(callback)
+
+    def on_reconnect(self, callback: Callable[[], None]):
+        self._reconnect_handlers.append(callback)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        connected_once = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                for channel in self._channels:
+                    await connection.add_listener(channel, self._on_notify)
+
+                if connected_once:
+                    logger.info("Notify listener reconnected")
+                    for callback in self._reconnect_handlers:
+                        callback()
+                connected_once = True
+
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), PING_INTERVAL)
+                    except asyncio.TimeoutError:
+                        await connection.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Notify listener failed")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        for callback in self._channels.get(channel, []):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Notify callback failed: %s", channel)
+
+
+class InvalidationBus:
+    """
+    Шина инвалидации кешей между воркерами.
+    Событие отправляется через pg_notify в транзакции изменения,
+    поэтому другие воркеры получают его только после коммита.
+    """
+
+    CHANNEL = "cache_invalidation"
+    USER_CHANGED = "user"
+    SESSION_CHANGED = "session"
+
+    def __init__(self, listener: NotifyListener):
+        self._handlers: dict[str, list[Callable[[int], None]]] = {}
+        self._reset_handlers: list[Callable[[], None]] = []
+        listener.subscribe(self.CHANNEL, self._on_message)
+        listener.on_reconnect(self._on_reconnect)
+
+    def on(self, event: str, handler: Callable[[int], None]):
+        self._handlers.setdefault(event, []).append(handler)
+
+    def on_reset(self, handler: Callable[[], None]):
+        # Полный сброс кеша, если события могли быть пропущены
+        self._reset_handlers.append(handler)
+
+    async def publish(self, session: AsyncSession, event: str, id: int):
+        payload = json.dumps({"event": event, "id": id})
+        await session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": self.CHANNEL, "payload": payload},
+        )
+
+    def dispatch(self, event: str, id: int):
+        for handler in self._handlers.get(event, []):
+            handler(id)
+
+    def _on_message(self, payload: str):
+        message = json.loads(payload)
+        self.dispatch(message["event"], message["id"])
+
+    def _on_reconnect(self):
+        for handler in self._reset_handlers:
+            handler()
@@ -0,0 +1,97 @@
+import base64
+import logging
+from datetime import datetime, timezone
+from typing import Annotated, AsyncIterator, Literal
+
+from fastapi import HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from backend import conf
+
+logger = logging.getLogger(__name__)
+
+NDJSON_CHUNK_ROWS = 500
+
+
+class Page(BaseModel):
+    # Keyset пагинация по ("created_timestamp", "id")
+    limit: int | None = None
+    after: tuple[datetime, int] | None = None
+    date_from: datetime | None = None
+    date_to: datetime | None = None
+    stream: bool = False
+
+
+def naive_utc(value: datetime | None) -> datetime | None:
+    # В БД колонки timestamp без зоны, время в UTC
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def cursor_encode(created_timestamp: datetime, id: int) -> str:
+    data = f"{created_timestamp.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def cursor_decode(cursor: str) -> tuple[datetime, int] | None:
+    try:
+        data = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_timestamp, id = data.split("|")
+        return datetime.fromisoformat(created_timestamp), int(id)
+    except ValueError:
+        return None
+
+
+def page_params(
+    limit: Annotated[int | None, Query(ge=1, le=conf.PAGE_MAX_LIMIT)] = None,
+    cursor: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    format: Literal["json", "ndjson"] = "json",
+) -> Page:
+    # Зависимость: параметры страницы из query
+    after = None
+    if cursor:
+        after = cursor_decode(cursor)
+        if not after:
+            logger.info("Wrong cursor")
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Wrong cursor",
+            )
+    return Page(
+        limit=limit,
+        after=after,
+        date_from=naive_utc(date_from),
+        date_to=naive_utc(date_to),
+        stream=format == "ndjson",
+    )
+
+
+def set_next_cursor(response: Response, page: Page, items: list) -> None:
+    # Курсор следующей страницы - в заголовке, тело остаётся списком
+    if page.limit and len(items) == page.limit:
+        last = items[-1]
+        response.headers["X-Next-Cursor"] = cursor_encode(
+            last.created_timestamp, last.id
+        )
+
+
+def ndjson_response(
+    rows: AsyncIterator[BaseModel], headers: dict[str, str] | None = None
+) -> StreamingResponse:
+    async def content() -> AsyncIterator[bytes]:
+        chunk = []
+        async for row in rows:
+            chunk.append(row.model_dump_json())
+            if len(chunk) >= NDJSON_CHUNK_ROWS:
+                yield ("\n".join(chunk) + "\n").encode()
+                chunk = []
+        if chunk:
+            yield ("\n".join(chunk) + "\n").encode()
+
+    return StreamingResponse(
+        content(), media_type="application/x-ndjson", headers=headers
+    )
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from datetime import date, datetime, timezone
+
+from backend.repository.payment import PaymentRepository, add_months
+
+logger = logging.getLogger(__name__)
+
+
+class PartitionManager:
+    """
+    Обслуживание помесячных секций payment в фоне: секции создаются
+    заранее на months_ahead месяцев вперёд, чтобы новые платежи не
+    попадали в payment_default. Если задан retention_months, секции
+    старше отсоединяются от payment.
+    """
+
+    def __init__(
+        self,
+        payment_repo: PaymentRepository,
+        months_ahead: int,
+        retention_months: int,
+        interval: float,
+    ):
+        self.payment_repo = payment_repo
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self._run_once()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> None:
+        today = datetime.now(timezone.utc).date()
+        month = date(today.year, today.month, 1)
+        months = [add_months(month, i) for i in range(self.months_ahead + 1)]
+        created = await self.payment_repo.create_partitions(months)
+        if created:
+            logger.info("Payment partitions created: %s", created)
+
+        if self.retention_months > 0:
+            detached = await self.payment_repo.detach_partitions(
+                before=add_months(month, -self.retention_months)
+            )
+            if detached:
+                logger.info("Payment partitions detached: %s", detached)
+
+    async def _run_once(self) -> None:
+        try:
+            await self.run_once()
+        except Exception:
+            logger.exception("Payment partition maintenance failed")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._run_once()
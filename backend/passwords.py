@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from backend import conf
+
+logger = logging.getLogger(__name__)
+
+PBKDF2 = "pbkdf2_sha256"
+SCRYPT = "scrypt"
+SALT_SIZE = 16
+HASH_CHUNK_SIZE = 100
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def _legacy_hash(password: str) -> str:
+    # Старый формат: sha256 с общей солью, без префикса
+    return (
+        hashlib.sha256((password + conf.PASSWORD_SALT).encode())
+        .hexdigest()
+        .lower()
+    )
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r
+    )
+
+
+class PasswordHasher:
+    """
+    Хеширование паролей в отдельном пуле потоков - медленный KDF
+    не блокирует event loop. pbkdf2 и scrypt из hashlib отпускают GIL,
+    поэтому потоки считают параллельно. Массовое хеширование (импорт)
+    идёт в своём пуле поменьше - вход не ждёт в очереди за импортом.
+    Формат хеша: "алгоритм$параметры$соль$хеш", хеши без префикса -
+    старый sha256, их нужно перехешировать.
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        workers: int,
+        bulk_workers: int,
+        pbkdf2_iterations: int,
+        scrypt_n: int,
+        scrypt_r: int,
+        scrypt_p: int,
+    ):
+        if algorithm not in (PBKDF2, SCRYPT):
+            raise ValueError(f"Unknown password hash algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.pbkdf2_iterations = pbkdf2_iterations
+        self.scrypt_params = (scrypt_n, scrypt_r, scrypt_p)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hasher"
+        )
+        self._bulk_executor = ThreadPoolExecutor(
+            max_workers=bulk_workers, thread_name_prefix="password-bulk"
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._bulk_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.hash_sync, password)
+
+    async def hash_many(self, passwords: list[str]) -> list[str]:
+        # Частями в пуле массового хеширования: пул входа и
+        # регистрации импорт не занимает
+        loop = asyncio.get_running_loop()
+        passwords = iter(passwords)
+        tasks = []
+        while chunk := list(islice(passwords, HASH_CHUNK_SIZE)):
+            tasks.append(
+                loop.run_in_executor(
+                    self._bulk_executor, self._hash_chunk, chunk
+                )
+            )
+        chunks = await asyncio.gather(*tasks)
+        return [password for chunk in chunks for password in chunk]
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(self.verify_sync, password, password_hash)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        # Старый формат или параметры отличаются от текущих настроек
+        return not password_hash.startswith(self._prefix())
+
+    def hash_sync(self, password: str) -> str:
+        salt = os.urandom(SALT_SIZE)
+        if self.algorithm == SCRYPT:
+            digest = _scrypt(password, salt, *self.scrypt_params)
+        else:
+            digest = hashlib.pbkdf2_hmac(
+                "sha256", password.encode(), salt, self.pbkdf2_iterations
+            )
+        return f"{self._prefix()}{_b64encode(salt)}${_b64encode(digest)}"
+
+    def verify_sync(self, password: str, password_hash: str) -> bool:
+        algorithm, _, params = password_hash.partition("$")
+        try:
+            if algorithm == PBKDF2:
+                iterations, salt, digest = params.split("$")
+                expected = hashlib.pbkdf2_hmac(
+                    "sha256",
+                    password.encode(),
+                    _b64decode(salt),
+                    int(iterations),
+                )
+            elif algorithm == SCRYPT:
+                n, r, p, salt, digest = params.split("$")
+                expected = _scrypt(
+                    password, _b64decode(salt), int(n), int(r), int(p)
+                )
+            else:
+                return hmac.compare_digest(
+                    _legacy_hash(password), password_hash
+                )
+            return hmac.compare_digest(expected, _b64decode(digest))
+        except ValueError:
+            logger.warning("Malformed password hash")
+            return False
+
+    def _prefix(self) -> str:
+        if self.algorithm == SCRYPT:
+            n, r, p = self.scrypt_params
+            return f"{SCRYPT}${n}${r}${p}$"
+        return f"{PBKDF2}${self.pbkdf2_iterations}$"
+
+    def _hash_chunk(self, passwords: list[str]) -> list[str]:
+        return [self.hash_sync(password) for password in passwords]
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
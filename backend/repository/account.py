@@ -1,12 +1,36 @@
 import logging
 from datetime import datetime
+from functools import partial
+from typing import AsyncIterator
 
 from pydantic import BaseModel
-from sqlalchemy import text
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from backend.loader import SingleFlight
+from backend.pagination import Page
+from backend.repository.base import (
+    BaseRepository,
+    fetch_val,
+    keyset_sql,
+)
+
 logger = logging.getLogger(__name__)
 
+# Баланс вместе с ещё не свёрнутыми изменениями из account_deltas
+ACCOUNT_COLUMNS = """
+    "accounts".id,
+    "accounts".user_id,
+    "accounts".balance + coalesce(
+        (
+            SELECT sum(amount)
+            FROM "account_deltas"
+            WHERE "account_deltas".account_id = "accounts".id
+        ),
+        0
+    ) AS balance,
+    "accounts".created_timestamp
+"""
+
 
 class Account(BaseModel):
     id: int
@@ -15,71 +39,119 @@ class Account(BaseModel):
     created_timestamp: datetime
 
 
-class AccountRepository:
-    def __init__(self, db: async_sessionmaker):
-        self.db = db
+class AccountRepository(BaseRepository):
+    def __init__(
+        self,
+        db: async_sessionmaker,
+        flight: SingleFlight | None = None,
+    ):
+        super().__init__(db=db, flight=flight)
 
     async def get_id(self, id: int) -> Account | None:
-        sql = """
-            SELECT *
+        sql = f"""
+            SELECT {ACCOUNT_COLUMNS}
             FROM "accounts"
             WHERE "id" = :id
         """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(text(sql), {"id": id})
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = Account(**result[0])
-                return result
-        return None
+        return await self.fetch_one(sql, {"id": id}, Account)
 
-    async def get_by_user_id(self, user_id: int) -> list[Account]:
-        sql = """
-            SELECT *
+    async def get_by_user_id(
+        self, user_id: int, page: Page | None = None
+    ) -> list[Account]:
+        return await self.coalesce(
+            ("accounts", user_id, page.model_dump_json() if page else None),
+            partial(self._get_by_user_id, user_id=user_id, page=page),
+        )
+
+    async def _get_by_user_id(
+        self, user_id: int, page: Page | None
+    ) -> list[Account]:
+        params = {"user_id": user_id}
+        sql = f"""
+            SELECT {ACCOUNT_COLUMNS}
             FROM "accounts"
-            WHERE "user_id" = :user_id
-        """
-        async with self.db() as session:
-            async with session.begin():
-                data = await session.execute(text(sql), {"user_id": user_id})
-        data = data.mappings().all()
-        return [Account(**account) for account in data]
+        """ + keyset_sql(
+            page, ['"user_id" = :user_id'], params
+        )
+        return await self.fetch_many(sql, params, Account)
 
-    async def create(
-        self, id: int, user_id: int, balance: int
-    ) -> Account | None:
-        sql = """
-            INSERT INTO "accounts" (id ,user_id, balance)
-            VALUES (:id, :user_id, :balance)
-            RETURNING *
+    async def get_version(self, user_id: int) -> str:
+        return await self.coalesce(
+            ("accounts_version", user_id),
+            partial(self._get_version, user_id=user_id),
+        )
+
+    async def _get_version(self, user_id: int) -> str:
+        # Метка версии счетов пользователя: меняется вместе с балансом
+        sql = f"""
+            SELECT coalesce(
+                md5(
+                    string_agg(
+                        id || ':' || balance, ','
+                        ORDER BY created_timestamp, id
+                    )
+                ),
+                ''
+            )
+            FROM (
+                SELECT {ACCOUNT_COLUMNS}
+                FROM "accounts"
+                WHERE "user_id" = :user_id
+            ) AS a
         """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(
-                    text(sql),
-                    {"id": id, "user_id": user_id, "balance": balance},
-                )
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = Account(**result[0])
-                return result
-        return None
+        return await self.fetch_val(sql, {"user_id": user_id})
 
-    async def increase(self, account_id: int, balance_increase: int):
-        sql = """
-            UPDATE "accounts"
-            SET balance = balance + :balance_increase
-            WHERE id = :account_id
+    def stream_by_user_id(
+        self, user_id: int, page: Page | None = None
+    ) -> AsyncIterator[Account]:
+        params = {"user_id": user_id}
+        sql = f"""
+            SELECT {ACCOUNT_COLUMNS}
+            FROM "accounts"
+        """ + keyset_sql(
+            page, ['"user_id" = :user_id'], params
+        )
+        return self.stream(sql, params, Account)
+
+    async def compact_deltas(self, limit: int) -> int:
         """
-        async with self.db() as session:
-            async with session.begin():
-                await session.execute(
-                    text(sql),
-                    {
-                        "account_id": account_id,
-                        "balance_increase": balance_increase,
-                    },
+        Перенос накопленных изменений из account_deltas в
+        accounts.balance: одно обновление на счёт вместо обновления на
+        каждый платёж. Сворачивает один воркер за раз.
+        """
+        sql = """
+            WITH moved AS (
+                DELETE FROM "account_deltas"
+                WHERE id IN (
+                    SELECT id
+                    FROM "account_deltas"
+                    ORDER BY id
+                    LIMIT :limit
                 )
+                RETURNING account_id, amount
+            ),
+            total AS (
+                SELECT account_id, sum(amount) AS amount
+                FROM moved
+                GROUP BY account_id
+            ),
+            upd AS (
+                UPDATE "accounts"
+                SET balance = "accounts".balance + total.amount
+                FROM total
+                WHERE "accounts".id = total.account_id
+            )
+            SELECT count(*)
+            FROM moved
+        """
+        async with self.session() as session:
+            locked = await fetch_val(
+                session,
+                "SELECT pg_try_advisory_xact_lock(hashtext('account_deltas'))",
+            )
+            if not locked:
+                return 0
+            moved = await fetch_val(session, sql, {"limit": limit})
+            if moved:
+                self.written(session)
+            return moved
@@ -0,0 +1,371 @@
+import logging
+import re
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import lru_cache, partial
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+    Mapping,
+    Sequence,
+    TypeVar,
+)
+
+import asyncpg
+from pydantic import BaseModel
+from sqlalchemy import CursorResult
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from backend.loader import SingleFlight
+from backend.notify import InvalidationBus
+from backend.pagination import Page
+
+logger = logging.getLogger(__name__)
+unit_of_work_contextvar = ContextVar("unit_of_work_contextvar", default=None)
+
+T = TypeVar("T")
+M = TypeVar("M", bound=BaseModel)
+
+# :name, но не ::тип; строки '...', имена "..." и комментарии
+# пропускаются целиком. E'...' и $$...$$ не разбираются - параметры
+# в SQL с ними подставлять нельзя
+PARAM = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/"""
+    r"|(?<!:):([A-Za-z_][A-Za-z0-9_]*)",
+    re.DOTALL,
+)
+DRIVER_TRANSACTION = "driver_transaction"
+
+
+def after_commit(session: AsyncSession, callback: Callable, *args):
+    # Колбэк выполнится после коммита транзакции сессии
+    session.info.setdefault("after_commit", []).append(
+        partial(callback, *args)
+    )
+
+
+def run_after_commit(session: AsyncSession):
+    for callback in session.info.pop("after_commit", []):
+        callback()
+
+
+def row_decoder(
+    model: type[M], keys: Sequence[str]
+) -> Callable[[Sequence], M]:
+    """
+    Сборка модели из строки результата без валидации и без словаря
+    RowMapping на строку - как model_construct, но позиции колонок
+    находятся один раз на весь результат. Только для строк из своих
+    колонок, типы которых совпадают с полями модели. Если каких-то
+    полей в результате нет - обычная валидация.
+    """
+    keys = list(keys)
+    fields = list(model.model_fields)
+    if not set(fields) <= set(keys):
+        return lambda row: model.model_validate(dict(zip(keys, row)))
+
+    fields_set = set(fields)
+    if keys == fields:
+
+        def values(row: Sequence) -> dict:
+            return dict(zip(fields, row))
+
+    else:
+        columns = [(name, keys.index(name)) for name in fields]
+
+        def values(row: Sequence) -> dict:
+            return {name: row[i] for name, i in columns}
+
+    def decode(row: Sequence) -> M:
+        obj = model.__new__(model)
+        object.__setattr__(obj, "__dict__", values(row))
+        object.__setattr__(obj, "__pydantic_fields_set__", fields_set)
+        object.__setattr__(obj, "__pydantic_extra__", None)
+        object.__setattr__(obj, "__pydantic_private__", None)
+        return obj
+
+    return decode
+
+
+class Query:
+    """
+    Запрос в формате asyncpg: именованные параметры :name заменены на
+    $n один раз при регистрации. Подготовленный запрос asyncpg хранит
+    в кеше соединения, повторно SQL не разбирается.
+    """
+
+    def __init__(self, sql: str):
+        self.names: list[str] = []
+        self.sql = PARAM.sub(self._placeholder, sql)
+
+    def _placeholder(self, match: re.Match) -> str:
+        name = match.group(1)
+        if name is None:
+            return match.group(0)
+        if name not in self.names:
+            self.names.append(name)
+        return f"${self.names.index(name) + 1}"
+
+    def args(self, params: dict) -> list:
+        return [params[name] for name in self.names]
+
+
+@lru_cache(maxsize=512)
+def query(sql: str) -> Query:
+    # Реестр запросов: каждый SQL переводится один раз
+    return Query(sql)
+
+
+async def first_statement(
+    session: AsyncSession, sql: str, args: Sequence
+) -> CursorResult | None:
+    """
+    SQLAlchemy открывает транзакцию в БД только при первом своём
+    execute, поэтому первый запрос транзакции сессии идёт через него -
+    иначе запросы драйвера ушли бы мимо транзакции. None - транзакция
+    уже открыта, запрос выполняется драйвером.
+    """
+    connection = await session.connection()
+    transaction = session.sync_session.get_transaction()
+    if session.info.get(DRIVER_TRANSACTION) is transaction:
+        return None
+    result = await connection.exec_driver_sql(sql, tuple(args))
+    session.info[DRIVER_TRANSACTION] = transaction
+    return result
+
+
+async def driver_connection(session: AsyncSession) -> asyncpg.Connection:
+    # Соединение asyncpg сессии - для COPY и курсоров; транзакция в БД
+    # к этому моменту должна быть открыта
+    await first_statement(session, "SELECT 1", ())
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    return raw_connection.driver_connection
+
+
+async def fetch(
+    session: AsyncSession, sql: str, params: dict | None = None
+) -> list[Mapping]:
+    # Строки с доступом к колонкам по имени
+    q = query(sql)
+    args = q.args(params or {})
+    result = await first_statement(session, q.sql, args)
+    if result is not None:
+        return result.mappings().all()
+    driver = await driver_connection(session)
+    return await driver.fetch(q.sql, *args)
+
+
+async def fetch_many(
+    session: AsyncSession,
+    sql: str,
+    params: dict | None,
+    model: type[M],
+) -> list[M]:
+    q = query(sql)
+    args = q.args(params or {})
+    result = await first_statement(session, q.sql, args)
+    if result is not None:
+        keys = list(result.keys())
+        rows = result.all()
+    else:
+        driver = await driver_connection(session)
+        rows = await driver.fetch(q.sql, *args)
+        keys = list(rows[0].keys()) if rows else []
+    if not rows:
+        return []
+    decode = row_decoder(model, keys)
+    return [decode(row) for row in rows]
+
+
+async def fetch_one(
+    session: AsyncSession,
+    sql: str,
+    params: dict | None,
+    model: type[M],
+) -> M | None:
+    q = query(sql)
+    args = q.args(params or {})
+    result = await first_statement(session, q.sql, args)
+    if result is not None:
+        keys = list(result.keys())
+        row = result.first()
+    else:
+        driver = await driver_connection(session)
+        row = await driver.fetchrow(q.sql, *args)
+        keys = list(row.keys()) if row is not None else []
+    if row is None:
+        return None
+    return row_decoder(model, keys)(row)
+
+
+async def fetch_val(
+    session: AsyncSession, sql: str, params: dict | None = None
+):
+    q = query(sql)
+    args = q.args(params or {})
+    result = await first_statement(session, q.sql, args)
+    if result is not None:
+        return result.scalar()
+    driver = await driver_connection(session)
+    return await driver.fetchval(q.sql, *args)
+
+
+async def execute(
+    session: AsyncSession, sql: str, params: dict | None = None
+) -> int:
+    # Число затронутых строк
+    q = query(sql)
+    args = q.args(params or {})
+    result = await first_statement(session, q.sql, args)
+    if result is not None:
+        return max(result.rowcount, 0)
+    driver = await driver_connection(session)
+    status = await driver.execute(q.sql, *args)
+    count = status.rsplit(" ", 1)[-1]
+    return int(count) if count.isdigit() else 0
+
+
+def keyset_sql(page: Page | None, conditions: list[str], params: dict) -> str:
+    # WHERE/ORDER BY/LIMIT для keyset пагинации, params дополняется
+    conditions = list(conditions)
+    if page is not None:
+        if page.date_from is not None:
+            conditions.append('"created_timestamp" >= :date_from')
+            params["date_from"] = page.date_from
+        if page.date_to is not None:
+            conditions.append('"created_timestamp" < :date_to')
+            params["date_to"] = page.date_to
+        if page.after is not None:
+            # отдельное условие на время - для отсечения секций
+            conditions.append('"created_timestamp" >= :after_timestamp')
+            conditions.append(
+                '("created_timestamp", "id") > (:after_timestamp, :after_id)'
+            )
+            params["after_timestamp"], params["after_id"] = page.after
+
+    sql = ""
+    if conditions:
+        sql += "WHERE " + " AND ".join(conditions)
+    sql += ' ORDER BY "created_timestamp", "id"'
+    if page is not None and page.limit is not None:
+        sql += " LIMIT :limit"
+        params["limit"] = page.limit
+    return sql
+
+
+class UnitOfWork:
+    """
+    Одна сессия и одна транзакция на весь запрос.
+    Сессия открывается лениво - при первом обращении репозитория.
+    """
+
+    def __init__(self, db: async_sessionmaker):
+        self.db = db
+        self._session: AsyncSession | None = None
+
+    async def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self.db()
+            await self._session.begin()
+        return self._session
+
+    async def commit(self):
+        if self._session is not None:
+            await self._session.commit()
+            run_after_commit(self._session)
+
+    async def rollback(self):
+        if self._session is not None:
+            self._session.info.pop("after_commit", None)
+            await self._session.rollback()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class BaseRepository:
+    def __init__(
+        self,
+        db: async_sessionmaker,
+        bus: InvalidationBus | None = None,
+        flight: SingleFlight | None = None,
+    ):
+        self.db = db
+        self.bus = bus
+        self.flight = flight
+
+    async def coalesce(
+        self, key: Hashable, call: Callable[[], Awaitable[T]]
+    ) -> T:
+        # Одинаковые одновременные чтения - одним запросом,
+        # в транзакции запроса читаем сами: видны свои записи
+        if self.flight is None or unit_of_work_contextvar.get() is not None:
+            return await call()
+        return await self.flight.do(key, call)
+
+    def written(self, session: AsyncSession) -> None:
+        # Запись меняет то, что читается через coalesce: после коммита
+        # начатые до него чтения не раздаются новым вызовам
+        if self.flight is not None:
+            after_commit(session, self.flight.advance)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        # Присоединяемся к транзакции запроса, если она открыта
+        uow: UnitOfWork | None = unit_of_work_contextvar.get()
+        if uow is not None:
+            yield await uow.session()
+            return
+
+        async with self.db() as session:
+            async with session.begin():
+                yield session
+            run_after_commit(session)
+
+    async def fetch_many(
+        self, sql: str, params: dict | None, model: type[M]
+    ) -> list[M]:
+        async with self.session() as session:
+            return await fetch_many(session, sql, params, model)
+
+    async def fetch_one(
+        self, sql: str, params: dict | None, model: type[M]
+    ) -> M | None:
+        async with self.session() as session:
+            return await fetch_one(session, sql, params, model)
+
+    async def fetch_val(self, sql: str, params: dict | None = None):
+        async with self.session() as session:
+            return await fetch_val(session, sql, params)
+
+    async def execute(self, sql: str, params: dict | None = None) -> int:
+        async with self.session() as session:
+            return await execute(session, sql, params)
+
+    async def publish(self, session: AsyncSession, event: str, id: int):
+        # Инвалидация кешей: другим воркерам - NOTIFY при коммите,
+        # своему - сразу после коммита
+        if self.bus is None:
+            return
+        await self.bus.publish(session=session, event=event, id=id)
+        after_commit(session, self.bus.dispatch, event, id)
+
+    async def stream(
+        self, sql: str, params: dict, model: type[BaseModel]
+    ) -> AsyncIterator[BaseModel]:
+        # Серверный курсор в своей транзакции: ответ читается уже
+        # после выхода из обработчика
+        q = query(sql)
+        async with self.db() as session:
+            async with session.begin():
+                driver = await driver_connection(session)
+                decode = None
+                async for row in driver.cursor(q.sql, *q.args(params)):
+                    if decode is None:
+                        decode = row_decoder(model, list(row.keys()))
+                    yield decode(row)
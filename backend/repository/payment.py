@@ -1,12 +1,49 @@
+import asyncio
 import logging
-from datetime import datetime
+import re
+from datetime import date, datetime
+from enum import Enum
+from functools import partial
+from typing import AsyncIterator
 
 from pydantic import BaseModel
-from sqlalchemy import text
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from backend.feed import PaymentFeed
+from backend.loader import SingleFlight
+from backend.pagination import Page
+from backend.repository.base import (
+    BaseRepository,
+    driver_connection,
+    execute,
+    fetch,
+    fetch_val,
+    keyset_sql,
+)
+
 logger = logging.getLogger(__name__)
 
+EXPORT_COLUMNS = (
+    "id, transaction_id, user_id, account_id, amount, created_timestamp"
+)
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_QUEUE_SIZE = 16
+PARTITION_NAME = re.compile(r"payment_y(\d{4})m(\d{2})")
+DEFAULT_PARTITION = "payment_default"
+# строк payment_daily на счёт и день в режиме ledger
+ROLLUP_SHARDS = 8
+
+
+def add_months(month: date, count: int) -> date:
+    # Первое число месяца через count месяцев
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    # Секция payment за месяц
+    return f"payment_y{month.year:04d}m{month.month:02d}"
+
 
 class Payment(BaseModel):
     id: int
@@ -17,46 +54,597 @@ class Payment(BaseModel):
     created_timestamp: datetime
 
 
-class PaymentRepository:
-    def __init__(self, db: async_sessionmaker):
-        self.db = db
+class NewPayment(BaseModel):
+    user_id: int
+    account_id: int
+    amount: int
+    transaction_id: str
+
+
+class DailyTotal(BaseModel):
+    day: date
+    amount: int
+    count: int
 
-    async def create(
-        self, user_id: int, account_id: int, amount: int, transaction_id: str
-    ) -> Payment | None:
+
+class AccountTotal(BaseModel):
+    account_id: int
+    user_id: int
+    amount: int
+    count: int
+
+
+class PaymentStatus(str, Enum):
+    CREATED = "created"
+    DUPLICATE = "duplicate"
+    USER_NOT_FOUND = "user_not_found"
+    WRONG_ACCOUNT = "wrong_account"
+    WRONG_SIGNATURE = "wrong_signature"
+
+
+class ConcurrentAccountCreation(Exception):
+    # Счёт создан другим пользователем параллельно с платежом
+    pass
+
+
+class PaymentRepository(BaseRepository):
+    def __init__(
+        self,
+        db: async_sessionmaker,
+        ledger: bool = False,
+        flight: SingleFlight | None = None,
+        feed: bool = False,
+    ):
+        super().__init__(db=db, flight=flight)
+        self.ledger = ledger
+        self.feed = feed
+        # в режиме direct строка счёта и так заблокирована пополнением,
+        # в ledger сумма за день раскладывается по нескольким строкам
+        self.rollup_shards = ROLLUP_SHARDS if ledger else 1
+
+    def _feed_sql(self, source: str) -> str:
+        # CTE feed - NOTIFY о каждом новом платеже, подписчики получат
+        # его после коммита
+        if not self.feed:
+            return f"feed AS (SELECT NULL FROM {source} WHERE false)"
+        return f"""
+            feed AS (
+                SELECT pg_notify(
+                    '{PaymentFeed.CHANNEL}',
+                    json_build_object(
+                        'id', id,
+                        'user_id', user_id,
+                        'account_id', account_id,
+                        'amount', amount,
+                        'transaction_id', transaction_id,
+                        'created_timestamp', created_timestamp
+                    )::text
+                )
+                FROM {source}
+            )
+            """
+
+    def _daily_sql(self, source: str) -> str:
+        # CTE daily - пополнение payment_daily платежами из source
+        return f"""
+            daily AS (
+                INSERT INTO "payment_daily"
+                    (account_id, day, shard, user_id, amount, count)
+                SELECT
+                    account_id,
+                    created_timestamp::date AS day,
+                    floor(random() * :rollup_shards)::smallint AS shard,
+                    user_id,
+                    sum(amount),
+                    count(*)
+                FROM {source}
+                GROUP BY account_id, created_timestamp::date, user_id
+                ORDER BY account_id, day, shard
+                ON CONFLICT (account_id, day, shard) DO UPDATE
+                    SET amount = "payment_daily".amount + EXCLUDED.amount,
+                        count = "payment_daily".count + EXCLUDED.count
+            )
+            """
+
+    def _apply_sql(self) -> str:
+        # CTE acc - созданные/пополненные счета, expected - сколько их
+        # должно быть; расхождение - счёт создан параллельно
+        if not self.ledger:
+            return """
+            acc AS (
+                INSERT INTO "accounts" (id, user_id, balance)
+                SELECT account_id, user_id, amount
+                FROM delta
+                ORDER BY account_id
+                ON CONFLICT (id) DO UPDATE
+                    SET balance = "accounts".balance + EXCLUDED.balance
+                    WHERE "accounts".user_id = EXCLUDED.user_id
+                RETURNING id
+            ),
+            expected AS (
+                SELECT account_id
+                FROM delta
+            )
+            """
+        # Существующие счета не блокируются: пополнение - новая строка
+        # в account_deltas, создаются только новые счета. Счёт, который
+        # параллельно создал тот же владелец, тоже возвращается в acc
+        return """
+            expected AS (
+                SELECT account_id, user_id
+                FROM delta
+                WHERE account_id IN (SELECT account_id FROM claim)
+            ),
+            acc AS (
+                INSERT INTO "accounts" (id, user_id)
+                SELECT account_id, user_id
+                FROM expected
+                ORDER BY account_id
+                ON CONFLICT (id) DO UPDATE
+                    SET user_id = EXCLUDED.user_id
+                    WHERE "accounts".user_id = EXCLUDED.user_id
+                RETURNING id
+            ),
+            ledger AS (
+                INSERT INTO "account_deltas" (account_id, amount)
+                SELECT account_id, amount
+                FROM delta
+            )
+            """
+
+    async def get_by_user_id(
+        self, user_id: int, page: Page | None = None
+    ) -> list[Payment]:
+        return await self.coalesce(
+            ("payment", user_id, page.model_dump_json() if page else None),
+            partial(self._get_by_user_id, user_id=user_id, page=page),
+        )
+
+    async def _get_by_user_id(
+        self, user_id: int, page: Page | None
+    ) -> list[Payment]:
+        params = {"user_id": user_id}
         sql = """
-            INSERT INTO "payment"
-                (user_id, account_id, amount, transaction_id)
-            VALUES (:user_id, :account_id, :amount, :transaction_id)
-            ON CONFLICT (transaction_id) DO NOTHING
-            RETURNING *
+               SELECT *
+               FROM "payment"
+           """ + keyset_sql(
+            page, ['"user_id" = :user_id'], params
+        )
+        return await self.fetch_many(sql, params, Payment)
+
+    async def get_version(self, user_id: int) -> str:
+        return await self.coalesce(
+            ("payment_version", user_id),
+            partial(self._get_version, user_id=user_id),
+        )
+
+    async def _get_version(self, user_id: int) -> str:
+        # Платежи не меняются - достаточно числа и последнего id
+        sql = """
+            SELECT count(*) || ':' || coalesce(max(id), 0)
+            FROM "payment"
+            WHERE "user_id" = :user_id
         """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(
-                    text(sql),
-                    {
-                        "user_id": user_id,
-                        "account_id": account_id,
-                        "amount": amount,
-                        "transaction_id": transaction_id,
-                    },
-                )
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = Payment(**result[0])
-                return result
-        return None
-
-    async def get_by_user_id(self, user_id: int) -> list[Payment]:
+        return await self.fetch_val(sql, {"user_id": user_id})
+
+    def stream_by_user_id(
+        self, user_id: int, page: Page | None = None
+    ) -> AsyncIterator[Payment]:
+        params = {"user_id": user_id}
         sql = """
                SELECT *
                FROM "payment"
-               WHERE "user_id" = :user_id
-           """
+           """ + keyset_sql(
+            page, ['"user_id" = :user_id'], params
+        )
+        return self.stream(sql, params, Payment)
+
+    async def export(
+        self,
+        user_id: int | None = None,
+        account_id: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        format: str = "csv",
+    ) -> AsyncIterator[bytes]:
+        """
+        Выгрузка платежей через COPY ... TO STDOUT (csv или ndjson).
+        Данные идут из БД клиенту кусками, без построения моделей.
+        """
+        conditions = []
+        args = []
+        for condition, value in (
+            ("user_id = ${}", user_id),
+            ("account_id = ${}", account_id),
+            ("created_timestamp >= ${}", date_from),
+            ("created_timestamp < ${}", date_to),
+        ):
+            if value is not None:
+                args.append(value)
+                conditions.append(condition.format(len(args)))
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        query = f"""
+            SELECT {EXPORT_COLUMNS}
+            FROM "payment"
+            {where}
+            ORDER BY created_timestamp, id
+        """
+        if format == "ndjson":
+            # csv с разделителем и кавычками, которых нет в json -
+            # строки выходят как есть
+            query = f"SELECT row_to_json(p) FROM ({query}) AS p"
+            options = {"format": "csv", "delimiter": "\x02", "quote": "\x01"}
+        else:
+            options = {"format": "csv", "header": True}
+
+        queue: asyncio.Queue[bytes | None] = asyncio.Queue(
+            maxsize=EXPORT_QUEUE_SIZE
+        )
+        buffer = bytearray()
+
+        async def sink(data: bytes):
+            buffer.extend(data)
+            if len(buffer) >= EXPORT_CHUNK_SIZE:
+                await queue.put(bytes(buffer))
+                buffer.clear()
+
         async with self.db() as session:
-            async with session.begin():
-                data = await session.execute(text(sql), {"user_id": user_id})
-        data = data.mappings().all()
-        return [Payment(**account) for account in data]
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+
+            async def copy():
+                try:
+                    await driver_connection.copy_from_query(
+                        query, *args, output=sink, **options
+                    )
+                    if buffer:
+                        await queue.put(bytes(buffer))
+                except asyncio.CancelledError:
+                    # клиент ушёл: очередь никто не читает, конец
+                    # выгрузки в неё не кладём - put на полной очереди
+                    # повис бы навсегда
+                    raise
+                except Exception:
+                    await queue.put(None)
+                    raise
+                await queue.put(None)
+
+            task = asyncio.create_task(copy())
+            try:
+                while (chunk := await queue.get()) is not None:
+                    yield chunk
+                await task
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+    async def get_recent(self, limit: int) -> list[NewPayment]:
+        # Последние платежи, от старых к новым
+        sql = """
+            SELECT user_id, account_id, amount, transaction_id
+            FROM "payment"
+            ORDER BY created_timestamp DESC, id DESC
+            LIMIT :limit
+        """
+        async with self.session() as session:
+            rows = await fetch(session, sql, {"limit": limit})
+        return [NewPayment(**payment) for payment in reversed(rows)]
+
+    @staticmethod
+    def _daily_where(
+        params: dict,
+        user_id: int | None,
+        account_id: int | None,
+        date_from: date | None,
+        date_to: date | None,
+    ) -> str:
+        # Фильтр по payment_daily, date_to не включается
+        where = []
+        for column, op, value in (
+            ("user_id", "=", user_id),
+            ("account_id", "=", account_id),
+            ("day", ">=", date_from),
+            ("day", "<", date_to),
+        ):
+            if value is not None:
+                name = f"{column}_{len(params)}"
+                where.append(f'"{column}" {op} :{name}')
+                params[name] = value
+        return "WHERE " + " AND ".join(where) if where else ""
+
+    async def get_daily_totals(
+        self,
+        user_id: int | None = None,
+        account_id: int | None = None,
+        date_from: date | None = None,
+        date_to: date | None = None,
+    ) -> list[DailyTotal]:
+        # Сумма и число платежей по дням - из payment_daily
+        params = {}
+        where = self._daily_where(
+            params, user_id, account_id, date_from, date_to
+        )
+        sql = f"""
+            SELECT day, sum(amount) AS amount, sum(count) AS count
+            FROM "payment_daily"
+            {where}
+            GROUP BY day
+            ORDER BY day
+        """
+        async with self.session() as session:
+            rows = await fetch(session, sql, params)
+        return [DailyTotal(**row) for row in rows]
+
+    async def get_account_totals(
+        self,
+        user_id: int | None = None,
+        account_id: int | None = None,
+        date_from: date | None = None,
+        date_to: date | None = None,
+    ) -> list[AccountTotal]:
+        # Сумма и число платежей по счетам за период
+        params = {}
+        where = self._daily_where(
+            params, user_id, account_id, date_from, date_to
+        )
+        sql = f"""
+            SELECT
+                account_id, user_id,
+                sum(amount) AS amount, sum(count) AS count
+            FROM "payment_daily"
+            {where}
+            GROUP BY account_id, user_id
+            ORDER BY account_id
+        """
+        async with self.session() as session:
+            rows = await fetch(session, sql, params)
+        return [AccountTotal(**row) for row in rows]
+
+    async def create_partitions(self, months: list[date]) -> list[str]:
+        """
+        Создание помесячных секций payment, которых ещё нет.
+        Воркеры создают секции по очереди - под advisory lock.
+        Платежи месяца, попавшие в секцию по умолчанию, переносятся в
+        новую секцию до её подключения - иначе подключение не пройдёт.
+        """
+        created = []
+        async with self.session() as session:
+            # DDL без параметров - мимо реестра запросов
+            driver = await driver_connection(session)
+            await driver.execute(
+                "SELECT pg_advisory_xact_lock(hashtext('payment'))"
+            )
+            for month in months:
+                name = partition_name(month)
+                exists = await fetch_val(
+                    session,
+                    "SELECT to_regclass(:name) IS NOT NULL",
+                    {"name": name},
+                )
+                if exists:
+                    continue
+                end = add_months(month, 1)
+                await driver.execute(
+                    f"""
+                    CREATE TABLE "{name}"
+                    (LIKE "payment" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                    """
+                )
+                moved = await execute(
+                    session,
+                    f"""
+                    WITH moved AS (
+                        DELETE FROM "{DEFAULT_PARTITION}"
+                        WHERE created_timestamp >= '{month}'
+                            AND created_timestamp < '{end}'
+                        RETURNING *
+                    )
+                    INSERT INTO "{name}"
+                    SELECT * FROM moved
+                    """,
+                )
+                if moved:
+                    logger.warning(
+                        "Moved %s payments from %s to %s",
+                        moved,
+                        DEFAULT_PARTITION,
+                        name,
+                    )
+                await driver.execute(
+                    f"""
+                    ALTER TABLE "payment" ATTACH PARTITION "{name}"
+                    FOR VALUES FROM ('{month}') TO ('{end}')
+                    """
+                )
+                created.append(name)
+        return created
+
+    async def detach_partitions(self, before: date) -> list[str]:
+        """
+        Отсоединение секций payment за месяцы до before.
+        Данные остаются в отдельных таблицах, уникальность transaction_id
+        по-прежнему держит payment_transactions.
+        """
+        sql = """
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'payment'::regclass
+        """
+        detached = []
+        async with self.session() as session:
+            driver = await driver_connection(session)
+            await driver.execute(
+                "SELECT pg_advisory_xact_lock(hashtext('payment'))"
+            )
+            names = [row["relname"] for row in await fetch(session, sql)]
+            for name in sorted(names):
+                match = PARTITION_NAME.fullmatch(name)
+                if not match:
+                    continue
+                month = date(int(match[1]), int(match[2]), 1)
+                if add_months(month, 1) > before:
+                    continue
+                await driver.execute(
+                    f'ALTER TABLE "payment" DETACH PARTITION "{name}"'
+                )
+                detached.append(name)
+            if detached:
+                self.written(session)
+        return detached
+
+    async def process(
+        self, user_id: int, account_id: int, amount: int, transaction_id: str
+    ) -> PaymentStatus:
+        """
+        Обработка одного платежа - за один запрос к БД.
+        """
+        payment = NewPayment(
+            user_id=user_id,
+            account_id=account_id,
+            amount=amount,
+            transaction_id=transaction_id,
+        )
+        statuses = await self.process_batch(payments=[payment])
+        return statuses[0]
+
+    async def process_batch(
+        self, payments: list[NewPayment]
+    ) -> list[PaymentStatus]:
+        """
+        Обработка пачки платежей одним запросом: проверка владельцев
+        счетов, создание счетов, идемпотентная вставка платежей и одно
+        суммарное пополнение баланса на каждый счёт.
+        Повтор transaction_id отсекает payment_transactions.
+        """
+        # повторы transaction_id внутри пачки отправляем в БД один раз
+        first: dict[str, int] = {}
+        for i, payment in enumerate(payments):
+            first.setdefault(payment.transaction_id, i)
+        unique = [payments[i] for i in first.values()]
+        if not unique:
+            return []
+
+        sql = f"""
+            WITH src AS (
+                SELECT *
+                FROM unnest(
+                    CAST(:user_ids AS int[]),
+                    CAST(:account_ids AS int[]),
+                    CAST(:amounts AS int[]),
+                    CAST(:transaction_ids AS varchar[])
+                ) WITH ORDINALITY
+                    AS src(user_id, account_id, amount, transaction_id, ord)
+            ),
+            owner AS (
+                SELECT
+                    src.ord,
+                    a.user_id AS account_user_id,
+                    u.id IS NOT NULL AS user_exists
+                FROM src
+                LEFT JOIN "accounts" a ON a.id = src.account_id
+                LEFT JOIN "users" u ON u.id = src.user_id
+            ),
+            claim AS (
+                SELECT DISTINCT ON (src.account_id)
+                    src.account_id, src.user_id
+                FROM src
+                JOIN owner USING (ord)
+                WHERE owner.account_user_id IS NULL AND owner.user_exists
+                ORDER BY src.account_id, src.ord
+            ),
+            valid AS (
+                SELECT src.*
+                FROM src
+                JOIN owner USING (ord)
+                LEFT JOIN claim USING (account_id)
+                WHERE coalesce(owner.account_user_id, claim.user_id)
+                    = src.user_id
+            ),
+            guard AS (
+                INSERT INTO "payment_transactions"
+                    (transaction_id, payment_id)
+                SELECT transaction_id, nextval('payment_id_seq')
+                FROM valid
+                ORDER BY transaction_id
+                ON CONFLICT (transaction_id) DO NOTHING
+                RETURNING transaction_id, payment_id, created_timestamp
+            ),
+            pay AS (
+                INSERT INTO "payment" (
+                    id, user_id, account_id, amount, transaction_id,
+                    created_timestamp
+                )
+                SELECT
+                    guard.payment_id, valid.user_id, valid.account_id,
+                    valid.amount, valid.transaction_id,
+                    guard.created_timestamp
+                FROM guard
+                JOIN valid USING (transaction_id)
+                RETURNING
+                    id, account_id, user_id, amount, transaction_id,
+                    created_timestamp
+            ),
+            {self._daily_sql("pay")},
+            {self._feed_sql("pay")},
+            delta AS (
+                SELECT account_id, user_id, sum(amount) AS amount
+                FROM pay
+                GROUP BY account_id, user_id
+            ),
+            {self._apply_sql()}
+            SELECT
+                owner.account_user_id,
+                owner.user_exists,
+                valid.ord IS NOT NULL AS valid,
+                pay.transaction_id IS NOT NULL AS created,
+                (SELECT count(*) FROM expected) AS accounts,
+                (SELECT count(*) FROM acc) AS applied,
+                (SELECT count(*) FROM feed) AS notified
+            FROM src
+            JOIN owner USING (ord)
+            LEFT JOIN valid USING (ord)
+            LEFT JOIN pay ON pay.transaction_id = src.transaction_id
+            ORDER BY src.ord
+        """
+        async with self.session() as session:
+            result = await fetch(
+                session,
+                sql,
+                {
+                    "user_ids": [p.user_id for p in unique],
+                    "account_ids": [p.account_id for p in unique],
+                    "amounts": [p.amount for p in unique],
+                    "transaction_ids": [p.transaction_id for p in unique],
+                    "rollup_shards": self.rollup_shards,
+                },
+            )
+            if result[0]["accounts"] != result[0]["applied"]:
+                # откатываем транзакцию, повтор вебхука увидит владельца
+                logger.warning("Account created concurrently")
+                raise ConcurrentAccountCreation()
+            self.written(session)
+
+        statuses = {}
+        for payment, row in zip(unique, result):
+            account_user_id = row["account_user_id"]
+            if account_user_id is None and not row["user_exists"]:
+                payment_status = PaymentStatus.USER_NOT_FOUND
+            elif not row["valid"]:
+                payment_status = PaymentStatus.WRONG_ACCOUNT
+            elif row["created"]:
+                payment_status = PaymentStatus.CREATED
+            else:
+                payment_status = PaymentStatus.DUPLICATE
+            statuses[payment.transaction_id] = payment_status
+
+        return [
+            (
+                PaymentStatus.DUPLICATE
+                if i != first[p.transaction_id]
+                and statuses[p.transaction_id] == PaymentStatus.CREATED
+                else statuses[p.transaction_id]
+            )
+            for i, p in enumerate(payments)
+        ]
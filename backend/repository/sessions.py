@@ -2,8 +2,9 @@ import logging
 from datetime import datetime
 
 from pydantic import BaseModel
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from backend.notify import InvalidationBus
+from backend.repository.base import BaseRepository, fetch, fetch_one
 
 logger = logging.getLogger(__name__)
 
@@ -15,26 +16,7 @@ class Session(BaseModel):
     created_timestamp: datetime
 
 
-class SessionsRepository:
-    def __init__(self, db: async_sessionmaker):
-        self.db = db
-
-    async def get_by_token(self, token: str) -> Session | None:
-        sql = """
-            SELECT *
-            FROM "user_sessions"
-            WHERE "token" = :token
-        """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(text(sql), {"token": token})
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = Session(**result[0])
-                return result
-        return None
-
+class SessionsRepository(BaseRepository):
     async def create(self, user_id: int, token: str) -> Session | None:
 
         sql = """
@@ -44,17 +26,14 @@ class SessionsRepository:
             RETURNING *
         """
 
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(
-                    text(sql), {"user_id": user_id, "token": token}
-                )
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = Session(**result[0])
-                return result
-        return None
+        async with self.session() as session:
+            result = await fetch_one(
+                session, sql, {"user_id": user_id, "token": token}, Session
+            )
+            await self.publish(
+                session, InvalidationBus.SESSION_CHANGED, user_id
+            )
+        return result
 
     async def get_by_user_id(self, user_id: int) -> Session | None:
         sql = """
@@ -62,22 +41,42 @@ class SessionsRepository:
             FROM "user_sessions"
             WHERE "user_id" = :user_id
         """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(text(sql), {"user_id": user_id})
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = Session(**result[0])
-                return result
-        return None
+        return await self.fetch_one(sql, {"user_id": user_id}, Session)
 
     async def delete(self, id: int):
         sql = """
             DELETE FROM "user_sessions"
             WHERE id = :id
+            RETURNING user_id
         """
-        async with self.db() as session:
-            async with session.begin():
-                await session.execute(text(sql), {"id": id})
+        async with self.session() as session:
+            rows = await fetch(session, sql, {"id": id})
+            for row in rows:
+                await self.publish(
+                    session, InvalidationBus.SESSION_CHANGED, row["user_id"]
+                )
         return
+
+    async def load_revocations(self, ttl: int) -> dict[int, int]:
+        """
+        Отозванные версии stateless токенов: user_id -> максимальная
+        отозванная версия. Записи старше ttl не нужны - токены этих
+        версий уже истекли, они удаляются.
+        """
+        sql = """
+            WITH pruned AS (
+                DELETE FROM "session_revocations"
+                WHERE created_timestamp
+                    < (now() at time zone 'utc')
+                        - CAST(:ttl AS int) * interval '1 second'
+            )
+            SELECT user_id, max(token_version) AS token_version
+            FROM "session_revocations"
+            WHERE created_timestamp
+                >= (now() at time zone 'utc')
+                    - CAST(:ttl AS int) * interval '1 second'
+            GROUP BY user_id
+        """
+        async with self.session() as session:
+            rows = await fetch(session, sql, {"ttl": ttl})
+        return {row["user_id"]: row["token_version"] for row in rows}
@@ -1,10 +1,24 @@
 import logging
 from datetime import datetime
+from enum import Enum
+from typing import AsyncIterator
 
 from pydantic import BaseModel
-from sqlalchemy import text
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from backend.loader import BatchLoader
+from backend.notify import InvalidationBus
+from backend.pagination import Page
+from backend.repository.base import (
+    BaseRepository,
+    driver_connection,
+    execute,
+    fetch,
+    fetch_one,
+    keyset_sql,
+    unit_of_work_contextvar,
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,29 +28,55 @@ class User(BaseModel):
     email: str
     is_admin: bool
     password: str
+    token_version: int = 0
     created_timestamp: datetime
 
 
-class UserRepository:
-    # можно сделать декоратор - обёртку для "фабрики" функций
-    def __init__(self, db: async_sessionmaker):
-        self.db = db
+class NewUser(BaseModel):
+    username: str
+    email: str
+    password: str
+
+
+class ImportStatus(str, Enum):
+    CREATED = "created"
+    EXISTS = "exists"
+    DUPLICATE = "duplicate"
+    INVALID = "invalid"
+
 
+class UserRepository(BaseRepository):
+    def __init__(
+        self,
+        db: async_sessionmaker,
+        bus: InvalidationBus | None = None,
+        loader_batch_size: int = 0,
+        loader_wait: float = 0,
+    ):
+        super().__init__(db=db, bus=bus)
+        self._loader = None
+        if loader_batch_size > 0:
+            self._loader = BatchLoader(
+                self.get_many,
+                max_batch_size=loader_batch_size,
+                wait=loader_wait,
+            )
+
+    # можно сделать декоратор - обёртку для "фабрики" функций
     async def get_id(self, id: int) -> User | None:
+        # в транзакции запроса читаем своё соединение - видны свои записи
+        if self._loader is None or unit_of_work_contextvar.get() is not None:
+            return (await self.get_many([id])).get(id)
+        return await self._loader.load(id)
+
+    async def get_many(self, ids: list[int]) -> dict[int, User]:
         sql = """
             SELECT *
             FROM "users"
-            WHERE "id" = :id
+            WHERE "id" = ANY(CAST(:ids AS int[]))
         """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(text(sql), {"id": id})
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = User(**result[0])
-                return result
-        return None
+        users = await self.fetch_many(sql, {"ids": ids}, User)
+        return {user.id: user for user in users}
 
     async def get_email(self, email: str) -> User | None:
         sql = """
@@ -44,15 +84,20 @@ class UserRepository:
             FROM "users"
             WHERE "email" = :email
         """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(text(sql), {"email": email})
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = User(**result[0])
-                return result
-        return None
+        return await self.fetch_one(sql, {"email": email}, User)
+
+    async def get_by_session(self, token: str, email: str) -> User | None:
+        # Пользователь по токену сессии - одним запросом
+        sql = """
+            SELECT "users".*
+            FROM "user_sessions"
+            JOIN "users" ON "users".id = "user_sessions".user_id
+            WHERE "user_sessions".token = :token
+                AND "users".email = :email
+        """
+        return await self.fetch_one(
+            sql, {"token": token, "email": email}, User
+        )
 
     async def create(
         self, username: str, email: str, salt_password: str
@@ -62,67 +107,146 @@ class UserRepository:
             VALUES (:username, :email, :password)
             RETURNING *
         """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(
-                    text(sql),
-                    {
-                        "username": username,
-                        "email": email,
-                        "password": salt_password,
-                    },
-                )
-        if result:
-            result = result.mappings().all()
-            if len(result) > 0:
-                result = User(**result[0])
-                return result
-        return None
-
-    async def get_all(self) -> list[User]:
+        return await self.fetch_one(
+            sql,
+            {"username": username, "email": email, "password": salt_password},
+            User,
+        )
+
+    async def get_existing_emails(self, emails: list[str]) -> set[str]:
         sql = """
-            SELECT *
+            SELECT email
             FROM "users"
+            WHERE "email" = ANY(:emails)
         """
-        async with self.db() as session:
-            async with session.begin():
-                data = await session.execute(text(sql), {"id": id})
-            data = data.mappings().all()
-            return [User(**user) for user in data]
+        async with self.session() as session:
+            rows = await fetch(session, sql, {"emails": emails})
+        return {row["email"] for row in rows}
+
+    async def import_users(self, users: list[NewUser]) -> list[int | None]:
+        """
+        Массовое создание: COPY во временную таблицу и перенос в users
+        одним запросом. Для уже занятых email возвращается None.
+        """
+        if not users:
+            return []
+        async with self.session() as session:
+            # COPY идёт в том же соединении и в той же транзакции
+            driver = await driver_connection(session)
+            await driver.execute(
+                """
+                CREATE TEMP TABLE "users_import" (
+                    "username" text not null,
+                    "email" text not null,
+                    "password" text not null
+                ) ON COMMIT DROP
+                """
+            )
+            await driver.copy_records_to_table(
+                "users_import",
+                records=[
+                    (user.username, user.email, user.password)
+                    for user in users
+                ],
+                columns=["username", "email", "password"],
+            )
+            rows = await driver.fetch(
+                """
+                INSERT INTO "users" (username, email, password)
+                SELECT username, email, password
+                FROM "users_import"
+                ON CONFLICT (email) DO NOTHING
+                RETURNING id, email
+                """
+            )
+            created = {row["email"]: row["id"] for row in rows}
+        return [created.get(user.email) for user in users]
+
+    async def get_all(self, page: Page | None = None) -> list[User]:
+        params = {}
+        sql = """
+            SELECT *
+            FROM "users"
+        """ + keyset_sql(
+            page, [], params
+        )
+        return await self.fetch_many(sql, params, User)
+
+    def stream_all(self, page: Page | None = None) -> AsyncIterator[User]:
+        params = {}
+        sql = """
+            SELECT *
+            FROM "users"
+        """ + keyset_sql(
+            page, [], params
+        )
+        return self.stream(sql, params, User)
 
     async def update(
         self, id: int, username: str, email: str, password: str
     ) -> User | None:
+        # старые stateless токены пользователя отзываются
+        sql = """
+            WITH upd AS (
+                UPDATE users
+                SET username = :username,
+                    email = :email,
+                    password = :password,
+                    token_version = token_version + 1
+                WHERE id = :id
+                RETURNING *
+            ),
+            revoked AS (
+                INSERT INTO session_revocations (user_id, token_version)
+                SELECT id, token_version - 1
+                FROM upd
+            )
+            SELECT *
+            FROM upd
+        """
+        async with self.session() as session:
+            user = await fetch_one(
+                session,
+                sql,
+                {
+                    "id": id,
+                    "username": username,
+                    "email": email,
+                    "password": password,
+                },
+                User,
+            )
+            if user:
+                await self.publish(session, InvalidationBus.USER_CHANGED, id)
+            return user
+
+    async def set_password(
+        self, id: int, password: str, old_password: str
+    ) -> bool:
+        # Перехеширование того же пароля: сессии не отзываются,
+        # хеш меняется, только если его не успели изменить
         sql = """
             UPDATE users
-            SET username = :username, email = :email, password = :password
-            WHERE id = :id
-            RETURNING *
+            SET password = :password
+            WHERE id = :id AND password = :old_password
         """
-        async with self.db() as session:
-            async with session.begin():
-                result = await session.execute(
-                    text(sql),
-                    {
-                        "id": id,
-                        "username": username,
-                        "email": email,
-                        "password": password,
-                    },
-                )
-            if result:
-                result = result.mappings().all()
-                if len(result) > 0:
-                    result = User(**result[0])
-                    return result
-            return None
+        updated = await self.execute(
+            sql, {"id": id, "password": password, "old_password": old_password}
+        )
+        return updated > 0
 
     async def delete(self, id: int):
         sql = """
-            DELETE FROM users
-            WHERE id = :id
+            WITH del AS (
+                DELETE FROM users
+                WHERE id = :id
+                RETURNING id, token_version
+            )
+            INSERT INTO session_revocations (user_id, token_version)
+            SELECT id, token_version
+            FROM del
         """
-        async with self.db() as session:
-            async with session.begin():
-                await session.execute(text(sql), {"id": id})
+        async with self.session() as session:
+            await execute(session, sql, {"id": id})
+            await self.publish(session, InvalidationBus.USER_CHANGED, id)
         return
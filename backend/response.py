@@ -0,0 +1,31 @@
+from typing import Any
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+
+class ModelJSONResponse(JSONResponse):
+    """
+    JSON ответ через pydantic_core: модели, списки моделей и даты
+    сериализуются сразу в байты за один проход, без json.dumps.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def model_response(
+    content: Any, response: Response | None = None
+) -> ModelJSONResponse:
+    """
+    Ответ в обход jsonable_encoder: готовый Response FastAPI отдаёт как
+    есть, поэтому заголовки и статус из параметра response обработчика
+    переносятся сюда.
+    """
+    result = ModelJSONResponse(content)
+    if response is not None:
+        if response.status_code:
+            result.status_code = response.status_code
+        result.headers.raw.extend(response.headers.raw)
+    return result
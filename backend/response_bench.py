@@ -0,0 +1,91 @@
+"""
+Скорость сериализации списков моделей в тело ответа: путь FastAPI по
+умолчанию (jsonable_encoder и JSONResponse) и ModelJSONResponse.
+Модели собираются в памяти, БД не нужна.
+
+Запуск: python -m backend.response_bench [строк]
+"""
+
+import sys
+import time
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from backend.repository.account import Account
+from backend.repository.payment import Payment
+from backend.repository.users import User
+from backend.response import ModelJSONResponse
+
+ROWS = 10_000
+REPEAT = 5
+
+
+def models(rows: int) -> list:
+    now = datetime.utcnow()
+    return [
+        [
+            User(
+                id=i,
+                username=f"user{i}",
+                email=f"user{i}@example.com",
+                is_admin=False,
+                password="0" * 64,
+                created_timestamp=now,
+            )
+            for i in range(rows)
+        ],
+        [
+            Account(
+                id=i, user_id=i % 1000, balance=i * 10, created_timestamp=now
+            )
+            for i in range(rows)
+        ],
+        [
+            Payment(
+                id=i,
+                user_id=i % 1000,
+                account_id=i % 5000,
+                amount=i % 100,
+                transaction_id=f"{i:032x}",
+                created_timestamp=now,
+            )
+            for i in range(rows)
+        ],
+    ]
+
+
+def best(call) -> float:
+    # Лучшее время из REPEAT запусков
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    print(f"{'model':<10}{'default':>14}{'model json':>14}{'speedup':>10}")
+    for items in models(rows):
+
+        def default():
+            return JSONResponse(jsonable_encoder(items)).body
+
+        def fast():
+            return ModelJSONResponse(items).body
+
+        body = default()
+        assert body == fast()
+        slow = len(body) / best(default) / 2**20
+        quick = len(body) / best(fast) / 2**20
+        print(
+            f"{type(items[0]).__name__:<10}{slow:>9.1f} MB/s{quick:>9.1f} MB/s"
+            f"{quick / slow:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
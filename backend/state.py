@@ -1,19 +1,52 @@
 import json
+from functools import partial
 
+from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 import backend.conf as conf
+from backend.cache import RevocationList, SessionCache, TransactionFilter
+from backend.feed import PaymentFeed
+from backend.ingest import PaymentSpool
+from backend.ledger import BalanceCompactor
+from backend.loader import SingleFlight
+from backend.notify import InvalidationBus, NotifyListener
+from backend.partitions import PartitionManager
+from backend.passwords import PasswordHasher
 from backend.repository.account import AccountRepository
 from backend.repository.payment import PaymentRepository
 from backend.repository.sessions import SessionsRepository
 from backend.repository.users import UserRepository
 
 
+class PoolStatus(BaseModel):
+    size: int
+    checked_out: int
+    idle: int
+    overflow: int
+    waiting: int
+
+
+class CountingQueuePool(AsyncAdaptedQueuePool):
+    # Пул, который считает корутины, ожидающие свободное соединение
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+
+    def _do_get(self):
+        self.waiting += 1
+        try:
+            return super()._do_get()
+        finally:
+            self.waiting -= 1
+
+
 class AppState:
     def __init__(self) -> None:
         self._async_engine = None
@@ -22,6 +55,21 @@ class AppState:
         self._sessions_repository = None
         self._account_repository = None
         self._payment_repository = None
+        self._payment_spool = None
+        self._partition_manager = None
+        self._balance_compactor = None
+        self._notify_listener = None
+        self._invalidation_bus = None
+        self._revocation_list = None
+        self._password_hasher = None
+        self._single_flight = None
+        self._payment_feed = None
+        self._transaction_filter = TransactionFilter(
+            max_size=conf.DEDUP_FILTER_SIZE
+        )
+        self._session_cache = SessionCache(
+            max_size=conf.SESSION_CACHE_SIZE, ttl=conf.SESSION_CACHE_TTL
+        )
 
     async def startup(self) -> None:
         # Создаем асинхронный engine с использованием asyncpg
@@ -30,7 +78,12 @@ class AppState:
             echo=False,
             json_serializer=json.dumps,
             json_deserializer=json.loads,
-            poolclass=NullPool,
+            poolclass=CountingQueuePool,
+            pool_size=conf.DB_POOL_SIZE,
+            max_overflow=conf.DB_MAX_OVERFLOW,
+            pool_timeout=conf.DB_POOL_TIMEOUT,
+            pool_recycle=conf.DB_POOL_RECYCLE,
+            pool_pre_ping=conf.DB_POOL_PRE_PING,
         )
         # Создаем фабрику сессий
         self._async_sessionmaker = async_sessionmaker(
@@ -39,21 +92,133 @@ class AppState:
             expire_on_commit=False,
         )
 
-        self._user_repository = UserRepository(db=self._async_sessionmaker)
+        self._password_hasher = PasswordHasher(
+            algorithm=conf.PASSWORD_HASH_ALGORITHM,
+            workers=conf.PASSWORD_HASH_WORKERS,
+            bulk_workers=conf.PASSWORD_BULK_HASH_WORKERS,
+            pbkdf2_iterations=conf.PBKDF2_ITERATIONS,
+            scrypt_n=conf.SCRYPT_N,
+            scrypt_r=conf.SCRYPT_R,
+            scrypt_p=conf.SCRYPT_P,
+        )
+
+        self._notify_listener = NotifyListener(dsn=conf.DATABASE_DSN)
+        self._invalidation_bus = InvalidationBus(
+            listener=self._notify_listener
+        )
+        for event in (
+            InvalidationBus.USER_CHANGED,
+            InvalidationBus.SESSION_CHANGED,
+        ):
+            self._invalidation_bus.on(
+                event, self._session_cache.invalidate_user
+            )
+        self._invalidation_bus.on_reset(self._session_cache.clear)
+        if conf.PAYMENT_FEED:
+            self._payment_feed = PaymentFeed(
+                listener=self._notify_listener,
+                queue_size=conf.PAYMENT_FEED_QUEUE_SIZE,
+            )
+        await self._notify_listener.start()
+
+        if conf.READ_COALESCING:
+            self._single_flight = SingleFlight()
+        self._user_repository = UserRepository(
+            db=self._async_sessionmaker,
+            bus=self._invalidation_bus,
+            loader_batch_size=conf.LOADER_MAX_BATCH_SIZE,
+            loader_wait=conf.LOADER_WAIT,
+        )
         self._sessions_repository = SessionsRepository(
-            db=self._async_sessionmaker
+            db=self._async_sessionmaker, bus=self._invalidation_bus
         )
         self._account_repository = AccountRepository(
-            db=self._async_sessionmaker
+            db=self._async_sessionmaker, flight=self._single_flight
         )
+        # работает и в режиме direct - досворачивает оставшиеся изменения
+        self._balance_compactor = BalanceCompactor(
+            account_repo=self._account_repository,
+            interval=conf.BALANCE_COMPACT_INTERVAL,
+            batch_size=conf.BALANCE_COMPACT_BATCH_SIZE,
+        )
+        await self._balance_compactor.start()
+
+        if conf.SESSION_MODE == "stateless":
+            self._revocation_list = RevocationList(
+                loader=partial(
+                    self._sessions_repository.load_revocations,
+                    ttl=conf.SESSION_TOKEN_TTL,
+                ),
+                refresh_interval=conf.REVOCATION_REFRESH_INTERVAL,
+            )
+            for event in (
+                InvalidationBus.USER_CHANGED,
+                InvalidationBus.SESSION_CHANGED,
+            ):
+                self._invalidation_bus.on(
+                    event, self._revocation_list.refresh_soon
+                )
+            self._invalidation_bus.on_reset(self._revocation_list.refresh_soon)
+            await self._revocation_list.start()
         self._payment_repository = PaymentRepository(
-            db=self._async_sessionmaker
+            db=self._async_sessionmaker,
+            ledger=conf.BALANCE_MODE == "ledger",
+            flight=self._single_flight,
+            feed=conf.PAYMENT_FEED,
         )
+        self._partition_manager = PartitionManager(
+            payment_repo=self._payment_repository,
+            months_ahead=conf.PAYMENT_PARTITION_MONTHS_AHEAD,
+            retention_months=conf.PAYMENT_PARTITION_RETENTION_MONTHS,
+            interval=conf.PAYMENT_PARTITION_INTERVAL,
+        )
+        await self._partition_manager.start()
+
+        if conf.DEDUP_FILTER_SIZE > 0:
+            recent = await self._payment_repository.get_recent(
+                limit=conf.DEDUP_FILTER_SIZE
+            )
+            for payment in recent:
+                self._transaction_filter.add(payment)
+
+        if conf.WEBHOOK_INGEST_MODE == "spool":
+            self._payment_spool = PaymentSpool(
+                directory=conf.INGEST_SPOOL_DIR,
+                handler=self._payment_repository.process_batch,
+                batch_size=conf.INGEST_BATCH_SIZE,
+                fsync_interval=conf.INGEST_FSYNC_INTERVAL,
+                max_attempts=conf.INGEST_MAX_ATTEMPTS,
+            )
+            await self._payment_spool.start()
 
     async def shutdown(self) -> None:
+        if self._revocation_list:
+            await self._revocation_list.stop()
+        if self._notify_listener:
+            await self._notify_listener.stop()
+        if self._payment_spool:
+            await self._payment_spool.stop()
+        if self._partition_manager:
+            await self._partition_manager.stop()
+        if self._balance_compactor:
+            await self._balance_compactor.stop()
+        if self._password_hasher:
+            self._password_hasher.shutdown()
         if self._async_engine:
             await self._async_engine.dispose()
 
+    def pool_status(self) -> PoolStatus:
+        # Текущая загрузка пула соединений воркера
+        assert self._async_engine
+        pool: CountingQueuePool = self._async_engine.pool
+        return PoolStatus(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            waiting=pool.waiting,
+        )
+
     @property
     def db(self) -> async_sessionmaker:
         assert self._async_sessionmaker
@@ -79,5 +244,34 @@ class AppState:
         assert self._payment_repository
         return self._payment_repository
 
+    @property
+    def session_cache(self) -> SessionCache:
+        return self._session_cache
+
+    @property
+    def revocation_list(self) -> RevocationList | None:
+        return self._revocation_list
+
+    @property
+    def password_hasher(self) -> PasswordHasher:
+        assert self._password_hasher
+        return self._password_hasher
+
+    @property
+    def transaction_filter(self) -> TransactionFilter:
+        return self._transaction_filter
+
+    @property
+    def single_flight(self) -> SingleFlight | None:
+        return self._single_flight
+
+    @property
+    def payment_feed(self) -> PaymentFeed | None:
+        return self._payment_feed
+
+    @property
+    def payment_spool(self) -> PaymentSpool | None:
+        return self._payment_spool
+
 
 app_state = AppState()
@@ -1,9 +1,24 @@
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+    status,
+)
 
+from backend.etag import make_etag, not_modified
 from backend.helper import check_session
+from backend.pagination import (
+    Page,
+    ndjson_response,
+    page_params,
+    set_next_cursor,
+)
 from backend.repository.users import User
+from backend.response import model_response
 from backend.state import app_state
 
 logger = logging.getLogger(__name__)
@@ -11,16 +26,43 @@ router = APIRouter()
 
 
 @router.get("/accounts")
-async def get_accounts(user: User = Depends(check_session)):
+async def get_accounts(
+    request: Request,
+    response: Response,
+    page: Page = Depends(page_params),
+    user: User = Depends(check_session),
+):
     """
     Получение счетов пользователя
     """
-    accounts = await app_state.account_repo.get_by_user_id(user_id=user.id)
-    return accounts
+    # версия читается до данных: если данные успели измениться,
+    # следующий запрос просто получит их ещё раз
+    version = await app_state.account_repo.get_version(user_id=user.id)
+    etag = make_etag("accounts", user.id, version, request.url.query)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    if page.stream:
+        return ndjson_response(
+            app_state.account_repo.stream_by_user_id(
+                user_id=user.id, page=page
+            ),
+            headers={"ETag": etag},
+        )
+    accounts = await app_state.account_repo.get_by_user_id(
+        user_id=user.id, page=page
+    )
+    set_next_cursor(response, page, accounts)
+    return model_response(accounts, response)
 
 
 @router.get("/user/{id}/accounts")
-async def get_user_accounts(id: int, admin: User = Depends(check_session)):
+async def get_user_accounts(
+    id: int,
+    response: Response,
+    page: Page = Depends(page_params),
+    admin: User = Depends(check_session),
+):
     """
     Получение счетов пользователя (админом)
     """
@@ -38,5 +80,14 @@ async def get_user_accounts(id: int, admin: User = Depends(check_session)):
             detail="User does not exist",
         )
 
-    accounts = await app_state.account_repo.get_by_user_id(user_id=user.id)
-    return accounts
+    if page.stream:
+        return ndjson_response(
+            app_state.account_repo.stream_by_user_id(
+                user_id=user.id, page=page
+            )
+        )
+    accounts = await app_state.account_repo.get_by_user_id(
+        user_id=user.id, page=page
+    )
+    set_next_cursor(response, page, accounts)
+    return model_response(accounts, response)
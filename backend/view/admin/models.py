@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from backend.repository.users import ImportStatus
 
 
 class AdminCreateUserBody(BaseModel):
@@ -11,3 +13,30 @@ class UpdateUserBody(BaseModel):
     username: str
     email: str
     password: str
+
+
+class ImportUserRow(BaseModel):
+    username: str = Field(min_length=1, max_length=32)
+    email: str = Field(min_length=1, max_length=32)
+    password: str = Field(min_length=1)
+
+
+class UserImportResult(BaseModel):
+    row: int
+    email: str | None
+    status: ImportStatus
+    id: int | None = None
+
+
+class UserImportResponse(BaseModel):
+    total: int
+    created: int
+    seconds: float
+    rows_per_second: float
+    results: list[UserImportResult]
+
+
+class PaymentTotals(BaseModel):
+    amount: int
+    count: int
+    days: int
@@ -1,16 +1,66 @@
+import codecs
+import csv
+import io
+import json
 import logging
+import time
+import zlib
+from datetime import date, datetime
+from typing import AsyncIterator, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
-from backend.helper import check_session, hash_password
-from backend.repository.users import User
-from backend.state import app_state
-from backend.view.admin.models import AdminCreateUserBody, UpdateUserBody
+from backend import conf
+from backend.cache import CacheStatus
+from backend.feed import FeedStatus
+from backend.helper import check_session, unit_of_work
+from backend.ingest import IngestStatus
+from backend.loader import FlightStatus
+from backend.pagination import (
+    Page,
+    naive_utc,
+    ndjson_response,
+    page_params,
+    set_next_cursor,
+)
+from backend.repository.payment import AccountTotal, DailyTotal
+from backend.repository.users import ImportStatus, NewUser, User
+from backend.response import model_response
+from backend.state import PoolStatus, app_state
+from backend.view.admin.models import (
+    AdminCreateUserBody,
+    ImportUserRow,
+    PaymentTotals,
+    UpdateUserBody,
+    UserImportResponse,
+    UserImportResult,
+)
 from backend.view.user.models import GetUserResponse
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Сжатие потока на лету, wbits=31 - формат gzip
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
 
 @router.put("/user")
 async def create_users(
@@ -34,9 +84,11 @@ async def create_users(
             status_code=status.HTTP_409_CONFLICT, detail="User already exist"
         )
 
-    # шифруем пароль
-    salt_password = hash_password(password=body.password)
-    logger.info(salt_password)
+    # шифруем пароль: без общей транзакции соединение на время KDF
+    # возвращено в пул
+    salt_password = await app_state.password_hasher.hash(
+        password=body.password
+    )
 
     user = await app_state.user_repo.create(
         username=body.username, email=body.email, salt_password=salt_password
@@ -44,16 +96,311 @@ async def create_users(
     return user
 
 
+async def read_import_body(
+    request: Request, max_lines: int, max_bytes: int
+) -> str:
+    """
+    Тело файла импорта. Размер и непустые строки считаются по мере
+    чтения: файл больше max_bytes или с числом строк больше max_lines
+    отвергается, не дочитываясь. Строка csv с переводом строки в
+    кавычках считается за несколько.
+    """
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail="File too large",
+    )
+    too_many = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail="Too many rows",
+    )
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes:
+        raise too_large
+
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    parts = []
+    size = 0
+    lines = 0
+    # в недочитанной строке уже есть непустые символы
+    filled = False
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_bytes:
+                raise too_large
+            part = decoder.decode(chunk)
+            parts.append(part)
+            *complete, last = part.split("\n")
+            for line in complete:
+                if filled or line.strip():
+                    lines += 1
+                filled = False
+            filled = filled or bool(last.strip())
+            if lines > max_lines:
+                raise too_many
+        parts.append(decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be utf-8",
+        )
+    # последняя строка без перевода строки
+    if filled:
+        lines += 1
+    if lines > max_lines:
+        raise too_many
+    return "".join(parts)
+
+
+def parse_import_rows(data: str, format: str) -> list:
+    # Строки файла импорта как словари, нечитаемая строка - None
+    if format == "csv":
+        return list(csv.DictReader(io.StringIO(data)))
+    rows = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        rows.append(row if isinstance(row, dict) else None)
+    return rows
+
+
+@router.post("/users/import")
+async def import_users(
+    request: Request,
+    format: Literal["csv", "ndjson"] = "csv",
+    admin: User = Depends(check_session),
+) -> UserImportResponse:
+    """
+    Массовое создание пользователей из csv (username,email,password)
+    или ndjson
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    started = time.perf_counter()
+    # у csv первая строка - заголовок
+    max_lines = conf.USER_IMPORT_MAX_ROWS + (format == "csv")
+    data = await read_import_body(
+        request, max_lines, conf.USER_IMPORT_MAX_BYTES
+    )
+    rows = parse_import_rows(data, format)
+    if len(rows) > conf.USER_IMPORT_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Too many rows",
+        )
+
+    # Первое вхождение email в файле создаётся, остальные - дубликаты
+    entries = []
+    users = []
+    emails = set()
+    for number, row in enumerate(rows, start=1):
+        try:
+            user = ImportUserRow.model_validate(row)
+        except ValidationError:
+            email = row.get("email") if isinstance(row, dict) else None
+            if not isinstance(email, str):
+                email = None
+            entries.append((number, email, ImportStatus.INVALID))
+            continue
+        if user.email in emails:
+            entries.append((number, user.email, ImportStatus.DUPLICATE))
+            continue
+        emails.add(user.email)
+        entries.append((number, user.email, None))
+        users.append(user)
+
+    # Пароли для уже занятых email не хешируем
+    existing = await app_state.user_repo.get_existing_emails(list(emails))
+    users = [user for user in users if user.email not in existing]
+    passwords = await app_state.password_hasher.hash_many(
+        [user.password for user in users]
+    )
+    ids = await app_state.user_repo.import_users(
+        [
+            NewUser(
+                username=user.username, email=user.email, password=password
+            )
+            for user, password in zip(users, passwords)
+        ]
+    )
+    created = sum(1 for id in ids if id is not None)
+    ids = iter(ids)
+    results = []
+    for number, email, import_status in entries:
+        id = None
+        if import_status is None and email in existing:
+            import_status = ImportStatus.EXISTS
+        elif import_status is None:
+            id = next(ids)
+            import_status = (
+                ImportStatus.EXISTS if id is None else ImportStatus.CREATED
+            )
+        results.append(
+            UserImportResult(
+                row=number, email=email, status=import_status, id=id
+            )
+        )
+
+    seconds = time.perf_counter() - started
+    logger.info(
+        "Users import: %s rows, %s created, %.0f rows/s",
+        len(rows),
+        created,
+        len(rows) / seconds,
+    )
+    return UserImportResponse(
+        total=len(rows),
+        created=created,
+        seconds=round(seconds, 3),
+        rows_per_second=round(len(rows) / seconds, 1),
+        results=results,
+    )
+
+
 @router.get("/users")
-async def get_all_users(admin: User = Depends(check_session)):
+async def get_all_users(
+    response: Response,
+    page: Page = Depends(page_params),
+    admin: User = Depends(check_session),
+):
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    if page.stream:
+        return ndjson_response(app_state.user_repo.stream_all(page=page))
+    users = await app_state.user_repo.get_all(page=page)
+    set_next_cursor(response, page, users)
+    return model_response(users, response)
+
+
+@router.get("/payments/export")
+async def export_payments(
+    user_id: int | None = None,
+    account_id: int | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    format: Literal["csv", "ndjson"] = "csv",
+    gzip: bool = False,
+    admin: User = Depends(check_session),
+):
+    """
+    Выгрузка платежей (COPY из БД потоком)
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    content = app_state.payment_repo.export(
+        user_id=user_id,
+        account_id=account_id,
+        date_from=naive_utc(date_from),
+        date_to=naive_utc(date_to),
+        format=format,
+    )
+    filename = f"payments.{format}"
+    media_type = EXPORT_MEDIA_TYPES[format]
+    if gzip:
+        content = gzip_stream(content)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/stats/payments/daily")
+async def get_payments_daily(
+    user_id: int | None = None,
+    account_id: int | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    admin: User = Depends(check_session),
+) -> list[DailyTotal]:
+    """
+    Сумма и число платежей по дням (date_to не включается)
+    """
     if not admin.is_admin:
         logger.info("Access denied")
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied",
         )
-    users = await app_state.user_repo.get_all()
-    return users
+    return await app_state.payment_repo.get_daily_totals(
+        user_id=user_id,
+        account_id=account_id,
+        date_from=date_from,
+        date_to=date_to,
+    )
+
+
+@router.get("/stats/payments/accounts")
+async def get_payments_by_account(
+    user_id: int | None = None,
+    account_id: int | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    admin: User = Depends(check_session),
+) -> list[AccountTotal]:
+    """
+    Сумма и число платежей по счетам за период
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    return await app_state.payment_repo.get_account_totals(
+        user_id=user_id,
+        account_id=account_id,
+        date_from=date_from,
+        date_to=date_to,
+    )
+
+
+@router.get("/stats/payments/totals")
+async def get_payments_totals(
+    user_id: int | None = None,
+    account_id: int | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    admin: User = Depends(check_session),
+) -> PaymentTotals:
+    """
+    Итог по платежам за период
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    days = await app_state.payment_repo.get_daily_totals(
+        user_id=user_id,
+        account_id=account_id,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    return PaymentTotals(
+        amount=sum(day.amount for day in days),
+        count=sum(day.count for day in days),
+        days=len(days),
+    )
 
 
 @router.get("/user/{id}")
@@ -95,7 +442,8 @@ async def update_user(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied",
         )
-    sault_pass = hash_password(password=body.password)
+    # одна запись - своя короткая транзакция, KDF считается до неё
+    sault_pass = await app_state.password_hasher.hash(password=body.password)
 
     user = await app_state.user_repo.update(
         id=id,
@@ -112,7 +460,7 @@ async def update_user(
     return user
 
 
-@router.delete("/user/{id}")
+@router.delete("/user/{id}", dependencies=[Depends(unit_of_work)])
 async def delete_user(id: int, admin: User = Depends(check_session)):
     """
     Удаление пользователя
@@ -137,3 +485,112 @@ async def delete_user(id: int, admin: User = Depends(check_session)):
     await app_state.user_repo.delete(id=id)
 
     return HTTPException(status_code=status.HTTP_200_OK)
+
+
+@router.get("/stats/pool")
+async def get_pool_status(admin: User = Depends(check_session)) -> PoolStatus:
+    """
+    Загрузка пула соединений с БД текущего воркера
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    return app_state.pool_status()
+
+
+@router.get("/stats/ingest")
+async def get_ingest_status(
+    admin: User = Depends(check_session),
+) -> IngestStatus:
+    """
+    Очередь вебхуков текущего воркера: глубина и отставание
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    if not app_state.payment_spool:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Spool ingest is disabled",
+        )
+    return app_state.payment_spool.status()
+
+
+@router.get("/stats/dedup")
+async def get_dedup_status(
+    admin: User = Depends(check_session),
+) -> CacheStatus:
+    """
+    Фильтр повторных вебхуков текущего воркера
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    return app_state.transaction_filter.status()
+
+
+@router.get("/stats/sessions")
+async def get_session_cache_status(
+    admin: User = Depends(check_session),
+) -> CacheStatus:
+    """
+    Кеш сессий текущего воркера
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    return app_state.session_cache.status()
+
+
+@router.get("/stats/coalescing")
+async def get_coalescing_status(
+    admin: User = Depends(check_session),
+) -> FlightStatus:
+    """
+    Склейка одинаковых одновременных чтений текущего воркера
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    if not app_state.single_flight:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Read coalescing is disabled",
+        )
+    return app_state.single_flight.status()
+
+
+@router.get("/stats/feed")
+async def get_feed_status(
+    admin: User = Depends(check_session),
+) -> FeedStatus:
+    """
+    Подписчики потока платежей текущего воркера
+    """
+    if not admin.is_admin:
+        logger.info("Access denied")
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied",
+        )
+    if not app_state.payment_feed:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment feed is disabled",
+        )
+    return app_state.payment_feed.status()
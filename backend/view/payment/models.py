@@ -1,9 +1,20 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from backend.repository.payment import PaymentStatus
+
+# Границы колонок int в БД: значение вне них БД не примет
+INT_MIN = -(2**31)
+INT_MAX = 2**31 - 1
 
 
 class PaymentBody(BaseModel):
-    user_id: int
-    account_id: int
-    amount: int
-    transaction_id: str
+    user_id: int = Field(ge=INT_MIN, le=INT_MAX)
+    account_id: int = Field(ge=INT_MIN, le=INT_MAX)
+    amount: int = Field(ge=INT_MIN, le=INT_MAX)
+    transaction_id: str = Field(max_length=64)
     signature: str
+
+
+class PaymentResult(BaseModel):
+    transaction_id: str
+    status: PaymentStatus
@@ -1,15 +1,62 @@
+import asyncio
 import logging
+from functools import partial
+from typing import Annotated, AsyncIterator, Awaitable, Callable, TypeVar
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import StreamingResponse
 
+from backend import conf
+from backend.etag import make_etag, not_modified
 from backend.helper import check_session, signature_payment_check
+from backend.pagination import (
+    Page,
+    ndjson_response,
+    page_params,
+    set_next_cursor,
+)
+from backend.repository.payment import (
+    ConcurrentAccountCreation,
+    NewPayment,
+    PaymentStatus,
+)
 from backend.repository.users import User
+from backend.response import model_response
 from backend.state import app_state
-from backend.view.payment.models import PaymentBody
+from backend.view.payment.models import PaymentBody, PaymentResult
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+T = TypeVar("T")
+
+
+async def retry_account_creation(call: Callable[[], Awaitable[T]]) -> T:
+    """
+    Счёт из платежа создан параллельным запросом - транзакция
+    откатилась, повтор увидит владельца счёта. Если и повтор
+    столкнулся с гонкой - 409, провайдер повторит вебхук.
+    """
+    try:
+        return await call()
+    except ConcurrentAccountCreation:
+        logger.info("Account created concurrently, retrying")
+    try:
+        return await call()
+    except ConcurrentAccountCreation:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Account created concurrently",
+        )
+
 
 @router.post("/webhook/payment")
 async def create_payment(body: PaymentBody):
@@ -28,44 +75,160 @@ async def create_payment(body: PaymentBody):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Wrong signature"
         )
-    account = await app_state.account_repo.get_id(id=body.account_id)
-    if not account:
-        user = await app_state.user_repo.get_id(id=body.user_id)
-        if not user:
-            logger.info("User does not exist")
-            return HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="User does not exist",
-            )
-        account = await app_state.account_repo.create(
-            id=body.account_id, user_id=body.user_id, balance=body.amount
-        )
-    if account.user_id != body.user_id:
-        logger.info("Wrong user id or account id")
-        return HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="Wrong user id or account id",
-        )
-    # Уникальность транзакции проверяется в sql запросе
-    payment = await app_state.payment_repo.create(
+    payment = NewPayment(
         user_id=body.user_id,
         account_id=body.account_id,
         amount=body.amount,
         transaction_id=body.transaction_id,
     )
+    if app_state.transaction_filter.contains(payment):
+        logger.info("Duplicate transaction")
+        return HTTPException(status_code=status.HTTP_200_OK)
 
-    if payment:
-        await app_state.account_repo.increase(
-            account_id=body.account_id, balance_increase=body.amount
+    if app_state.payment_spool:
+        # Подтверждаем после записи в очередь, в БД запишет воркер
+        await app_state.payment_spool.append(payment)
+        return HTTPException(status_code=status.HTTP_200_OK)
+
+    # Уникальность транзакции проверяется в sql запросе
+    payment_status = await retry_account_creation(
+        partial(
+            app_state.payment_repo.process,
+            user_id=payment.user_id,
+            account_id=payment.account_id,
+            amount=payment.amount,
+            transaction_id=payment.transaction_id,
+        )
+    )
+    if payment_status in (PaymentStatus.CREATED, PaymentStatus.DUPLICATE):
+        app_state.transaction_filter.add(payment)
+    if payment_status == PaymentStatus.USER_NOT_FOUND:
+        logger.info("User does not exist")
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="User does not exist",
+        )
+    if payment_status == PaymentStatus.WRONG_ACCOUNT:
+        logger.info("Wrong user id or account id")
+        return HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Wrong user id or account id",
         )
 
     return HTTPException(status_code=status.HTTP_200_OK)
 
 
+@router.post("/webhook/payment/batch")
+async def create_payments(
+    body: Annotated[
+        list[PaymentBody], Body(max_length=conf.PAYMENT_BATCH_MAX_SIZE)
+    ],
+) -> list[PaymentResult]:
+    """
+    Обработка пачки вебхуков - создание платежей
+    """
+    statuses = []
+    payments = []
+    for item in body:
+        is_correct_signature = signature_payment_check(
+            user_id=item.user_id,
+            account_id=item.account_id,
+            amount=item.amount,
+            transaction_id=item.transaction_id,
+            signature=item.signature,
+        )
+        if not is_correct_signature:
+            logger.info("Wrong signature: %s", item.transaction_id)
+            statuses.append(PaymentStatus.WRONG_SIGNATURE)
+            continue
+        payment = NewPayment(
+            user_id=item.user_id,
+            account_id=item.account_id,
+            amount=item.amount,
+            transaction_id=item.transaction_id,
+        )
+        if app_state.transaction_filter.contains(payment):
+            statuses.append(PaymentStatus.DUPLICATE)
+            continue
+        statuses.append(None)
+        payments.append(payment)
+
+    processed = await retry_account_creation(
+        partial(app_state.payment_repo.process_batch, payments)
+    )
+    for payment, payment_status in zip(payments, processed):
+        if payment_status in (PaymentStatus.CREATED, PaymentStatus.DUPLICATE):
+            app_state.transaction_filter.add(payment)
+    processed = iter(processed)
+    return [
+        PaymentResult(
+            transaction_id=item.transaction_id,
+            status=payment_status or next(processed),
+        )
+        for item, payment_status in zip(body, statuses)
+    ]
+
+
 @router.get("/payment")
-async def get_accounts(user: User = Depends(check_session)):
+async def get_accounts(
+    request: Request,
+    response: Response,
+    page: Page = Depends(page_params),
+    user: User = Depends(check_session),
+):
     """
     Получение платежей пользователя
     """
-    payments = await app_state.payment_repo.get_by_user_id(user_id=user.id)
-    return payments
+    version = await app_state.payment_repo.get_version(user_id=user.id)
+    etag = make_etag("payment", user.id, version, request.url.query)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
+    if page.stream:
+        return ndjson_response(
+            app_state.payment_repo.stream_by_user_id(
+                user_id=user.id, page=page
+            ),
+            headers={"ETag": etag},
+        )
+    payments = await app_state.payment_repo.get_by_user_id(
+        user_id=user.id, page=page
+    )
+    set_next_cursor(response, page, payments)
+    return model_response(payments, response)
+
+
+async def feed_events(user_id: int) -> AsyncIterator[bytes]:
+    # События SSE: платежи пользователя, reset - события могли быть
+    # потеряны и список нужно перечитать; комментарий - heartbeat
+    with app_state.payment_feed.subscribe(user_id) as queue:
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(
+                    queue.get(), conf.PAYMENT_FEED_HEARTBEAT
+                )
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            if item is None:
+                return
+            event, data = item
+            yield f"event: {event}\ndata: {data}\n\n".encode()
+
+
+@router.get("/payment/feed")
+async def get_payment_feed(user: User = Depends(check_session)):
+    """
+    Новые платежи пользователя (Server-Sent Events)
+    """
+    if not app_state.payment_feed:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Payment feed is disabled",
+        )
+    return StreamingResponse(
+        feed_events(user_id=user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
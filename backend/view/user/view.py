@@ -1,9 +1,23 @@
 import logging
 from typing import Annotated
 
-from fastapi import APIRouter, Body, Depends, HTTPException, Response, status
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    HTTPException,
+    Request,
+    Response,
+    status,
+)
 
-from backend.helper import check_session, cookie_create, hash_password
+from backend import conf
+from backend.etag import make_etag, not_modified
+from backend.helper import (
+    check_session,
+    cookie_create,
+    token_create,
+)
 from backend.repository.users import User
 from backend.state import app_state
 from backend.view.user.models import GetUserResponse, UserAuthBody
@@ -19,6 +33,8 @@ async def auth_users(
     """
     Авторизация пользователя
     """
+    # без общей транзакции: пока считается KDF, соединение не держим,
+    # каждая запись ниже - своя короткая транзакция
     exist_user = await app_state.user_repo.get_email(email=body.email)
 
     if not exist_user:
@@ -29,26 +45,48 @@ async def auth_users(
 
     db_user = await app_state.user_repo.get_email(email=body.email)
 
-    if db_user.password != hash_password(password=body.password):
+    hasher = app_state.password_hasher
+    if not await hasher.verify(
+        password=body.password, password_hash=db_user.password
+    ):
         logger.info("Access denied - wrong password")
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied - wrong password",
         )
+    if hasher.needs_rehash(db_user.password):
+        # старый формат хеша - пароль известен, перехешируем
+        await app_state.user_repo.set_password(
+            id=db_user.id,
+            password=await hasher.hash(password=body.password),
+            old_password=db_user.password,
+        )
 
-    token = cookie_create(email=body.email)
-
-    await app_state.session_repo.create(user_id=db_user.id, token=token)
+    if conf.SESSION_MODE == "stateless":
+        # текущая версия: токены отзываются только изменением или
+        # удалением пользователя, вход не перезагружает список отзыва
+        token = token_create(
+            user_id=db_user.id, token_version=db_user.token_version
+        )
+    else:
+        token = cookie_create(email=body.email)
+        await app_state.session_repo.create(user_id=db_user.id, token=token)
     response.set_cookie(key="cookie", value=token)
     return token
 
 
 @router.get("/user")
-async def get_users(user: User = Depends(check_session)):
+async def get_users(
+    request: Request, response: Response, user: User = Depends(check_session)
+):
     """
     Получение данных о пользователе
     """
-
+    # пользователь уже загружен при проверке сессии
+    etag = make_etag("user", user.id, user.username, user.email)
+    if cached := not_modified(request, etag):
+        return cached
+    response.headers["ETag"] = etag
     return GetUserResponse(
         id=user.id, username=user.username, email=user.email
     )